@@ -2,12 +2,12 @@ __author__ = 'Dylan Klein'
 '''This file defines the class for creating grid world environments as an object'''
 
 from STAGE_1.State_Space import make_states
-from tkinter import *  # For rendering
+from STAGE_1.Transitions import Transitions
 
 
 class Grid_World:
 
-    def __init__(self, width, height, initial_state, walls, specials):
+    def __init__(self, width, height, initial_state, walls, specials, render_mode="tk"):
 
         # User defined variables
         self.width = width
@@ -18,7 +18,7 @@ class Grid_World:
 
         # Multi-agent variables
         self.num_agents = int(len(initial_state) / 2)  # The number of agents in this environment
-        self.state_space = make_states(self.num_agents, self.width, self.height)  # Create the entire state space
+        self.state_space = make_states(self.num_agents, self.width, self.height)  # Create the lazy state space (no states are enumerated)
         self.goal_count = 0  # To count how many agents have reached their respective goals in each episode
         self.goal_flags = [0] * self.num_agents  # To track which agents have reached their goals in each episode
         self.common_goal_flag = 0  # If agents collide on a common goal, do not punish
@@ -36,20 +36,33 @@ class Grid_World:
         self.actions = ["up", "down", "left", "right", "none"]
         self.wall_punishment = 1
         self.walk_punishment = 0.04
+        self.transitions = Transitions(self.width, self.height, self.walls, self.actions)  # Compile the map for moving
+        self.next_cell = self.transitions.next_cell_list
+        self.blocked = self.transitions.blocked_list
+        self.action_index = self.transitions.action_index
+        Grid_World.count_occupancy(self)
+
+        # Only a "tk" world draws to a window ("none" runs headless and never imports Tk)
+        self.render_mode = render_mode
+        if self.render_mode == "tk":
+            Grid_World.make_board(self)
+
+    # Create a board to render to
+    def make_board(self):
+        from tkinter import Tk, Canvas
 
-        # Create a board to render to
         self.master = Tk()
         self.L = 100  # side length of a cell in pixels
         self.board = Canvas(self.master, width=self.width * self.L, height=self.height * self.L)
         self.board.grid(row=0, column=0)
 
         # Render the static components of the environment
-        for i in range(width):
-            for j in range(height):
+        for i in range(self.width):
+            for j in range(self.height):
                 self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill="white", width=1)
-        for (a_id, (i, j), c, r) in specials:
+        for (a_id, (i, j), c, r) in self.specials:
             self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill=c, width=1)
-        for (i, j) in walls:
+        for (i, j) in self.walls:
             self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill="black", width=1)
 
         # Create objects for rendering agents
@@ -66,7 +79,8 @@ class Grid_World:
 
     # Start rendering the 'master' object
     def start_game(self):
-        self.master.mainloop()
+        if self.render_mode == "tk":
+            self.master.mainloop()
 
     def reset(self):
         self.state = list(self.init_state)  # Set the current state to the initial state
@@ -77,9 +91,19 @@ class Grid_World:
         self.collisions = 0
         self.restart = False
         self.episode_count += 1
+        Grid_World.count_occupancy(self)
         return tuple(self.state)
 
+    # Find every agent's cell and count how many agents stand in each cell
+    def count_occupancy(self):
+        self.cells = [self.transitions.cell(self.state[2*i], self.state[2*i+1]) for i in range(self.num_agents)]
+        self.occupancy = [0] * self.transitions.num_cells
+        for cell in self.cells:
+            self.occupancy[cell] += 1
+
     def render(self):
+        if self.render_mode != "tk":
+            return
         for i in range(self.num_agents):
             position = (self.state[2*i], self.state[2*i+1])
             self.board.coords(self.objects[i],
@@ -93,34 +117,27 @@ class Grid_World:
         # Initialise the reward for the step
         self.reward = 0
 
-        # Calculate incremental changes in x,y coordinates
-        if action == self.actions[0]:
-            (dx, dy) = (0, -1)  # UP
-        elif action == self.actions[1]:
-            (dx, dy) = (0, 1)  # DOWN
-        elif action == self.actions[2]:
-            (dx, dy) = (-1, 0)  # LEFT
-        elif action == self.actions[3]:
-            (dx, dy) = (1, 0)  # RIGHT
-        else:
-            (dx, dy) = (0, 0)  # NONE
-
-        # Calculate the new proposed position
-        position = (self.state[2*i], self.state[2*i+1])
-        new_x = position[0] + dx
-        new_y = position[1] + dy
-
-        # Try move the caller agent to a new cell if possible
-        if (new_x >= 0) and (new_x < self.width) and (new_y >= 0) and (new_y < self.height) and not ((new_x, new_y) in self.walls):
+        # Look up the move in the compiled transition tables
+        cell = self.cells[i]
+        a = self.action_index[action]
+
+        # Try move the caller agent to a new cell if possible (keeping the occupancy grid up to date)
+        blocked = self.blocked[cell][a]
+        if not blocked:
+            new_cell = self.next_cell[cell][a]
+            self.occupancy[cell] -= 1
+            self.occupancy[new_cell] += 1
+            self.cells[i] = new_cell
+            (new_x, new_y) = self.transitions.cell_xy_list[new_cell]
             (self.state[2*i], self.state[2*i+1]) = (new_x, new_y)
             self.common_goal_flag = 0
             self.reward = -self.walk_punishment
         else:
             self.reward = -self.wall_punishment  # Punish if a wall is touched (for faster convergence)
 
-        # Check for landing on a green or red space
+        # Check for landing on a green or red space (walls and the outside of the world are never special)
         for (a_id, (x, y), c, r) in self.specials:
-            if new_x == x and new_y == y and (a_id == i+1 or a_id == 0):
+            if not blocked and new_x == x and new_y == y and (a_id == i+1 or a_id == 0):
                 self.reward = r
                 if a_id == 0:
                     self.common_goal_flag = 1
@@ -137,28 +154,13 @@ class Grid_World:
             self.restart = True
 
         # Check for a collision of agents
-        for n in range(self.num_agents):
-            if Grid_World.has_collided(self, i) is True and self.common_goal_flag == 0:
-                for j in range(self.num_agents):
-                    self.reward = -self.crash_punishment
-                self.restart = True
-                self.collisions += 1
+        if Grid_World.has_collided(self, i) is True and self.common_goal_flag == 0:
+            self.reward = -self.crash_punishment
+            self.restart = True
+            self.collisions += 1
 
         return tuple(self.state), self.reward, self.restart, self.episode_count
 
-    # Check to see if any agents have the same coordinates, indicating that a collision has occurred
+    # Check to see if any other agent stands in agent i's cell, indicating that a collision has occurred
     def has_collided(self, i):
-
-        # Remove the caller agent's own coordinates from the state list in order to compare with other agents
-        other_agents = tuple(self.state)
-        other_agents = list(other_agents)
-        del other_agents[2*i]
-        del other_agents[2*i]
-
-        # Search the modified state list for other agents who occupy the same space
-        for j in range(self.num_agents - 1):
-            if (other_agents[2*j], other_agents[2*j+1]) == (self.state[2*i], self.state[2*i+1]):
-                return True
-            else:
-                pass
-        return False
+        return self.occupancy[self.cells[i]] > 1
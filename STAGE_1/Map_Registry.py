@@ -0,0 +1,116 @@
+__author__ = 'Dylan Klein'
+'''This file reads maps from the Maps directory and compiles them into arrays, cached on disk by content hash'''
+
+from STAGE_1.Transitions import Transitions
+import numpy as np
+import hashlib
+import json
+import os
+
+MAP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Maps")  # Shared by both stages
+CACHE_DIR = os.path.join(MAP_DIR, ".cache")
+COMPILER_VERSION = 1  # Bump when the compiled arrays change, so that stale cache files are never used
+COMPILED = ["cell_xy", "wall_mask", "next_cell", "blocked", "goal_cells", "start_cells"]
+
+loaded = {}  # Maps read by this process, by name (each keeps the Transitions it has compiled)
+
+
+'''
+    *** MAP FILES ***
+    A map is a JSON file Maps/<name>.json, for example:
+        {
+            "name": "plus",
+            "grid": [
+                "##C##",
+                "##.##",
+                "B...D",
+                "##.##",
+                "##A##"
+            ],
+            "goals": [
+                [[4, 2], [0, 0, 0, 1]],
+                ...
+            ],
+            "mode": "non-episodic"
+        }
+    - 'grid' draws the world one row of cells per string (y = 0 first): "#" is a wall, "." an open cell, and the
+      letters "A", "B", ... are open cells where agents A, B, ... start
+    - 'goals' lists ((x, y), g_id) entries for STAGE_2 worlds, where g_id is the goal id in one-hot coding
+    - 'specials' lists (a_id, (x, y), c, r) entries for STAGE_1 worlds (see STAGE_1/Make_World.py)
+    - 'mode' is "episodic" or "non-episodic" for STAGE_2 worlds
+'''
+
+
+class Map:
+    """
+        A map read from its file: the lists a World is created from (walls, goals, starts, ...), plus the SHA-1
+        digest of the file, which keys its compiled arrays in the cache.
+    """
+
+    def __init__(self, name, data, digest):
+
+        spec = json.loads(data)
+        grid = spec["grid"]
+        self.name = name
+        self.digest = digest
+        self.width = len(grid[0])
+        self.height = len(grid)
+        if any(len(row) != self.width for row in grid):
+            raise ValueError("Every row of the grid of map %r must have %d cells" % (name, self.width))
+
+        self.walls = [(x, y) for y in range(self.height) for x in range(self.width) if grid[y][x] == "#"]
+        starts = sorted((grid[y][x], (x, y)) for y in range(self.height) for x in range(self.width) if grid[y][x].isalpha())
+        self.starts = [xy for (letter, xy) in starts]  # In the order of the agents' letters
+        self.init_state = tuple(c for xy in self.starts for c in xy)  # As STAGE_1's Grid_World takes the starts
+        self.goals = [((x, y), tuple(g_id)) for ((x, y), g_id) in spec.get("goals", [])]
+        self.specials = [(a_id, (x, y), c, r) for (a_id, (x, y), c, r) in spec.get("specials", [])]
+        self.map_mode = spec.get("mode", "episodic")
+        self.compiled = {}  # Transitions compiled for each list of actions
+
+    # Compile the map for a list of actions, reading the arrays from the cache if they have been compiled before
+    def transitions(self, actions):
+        key = tuple(actions)
+        if key not in self.compiled:
+            self.compiled[key] = Map.load_compiled(self, actions)
+        return self.compiled[key]
+
+    # The cache file of the arrays compiled for a list of actions
+    def cache_path(self, actions):
+        key = hashlib.sha1(("%s %d %s" % (self.digest, COMPILER_VERSION, " ".join(actions))).encode()).hexdigest()
+        return os.path.join(CACHE_DIR, "%s-%s.npz" % (self.name, key[:16]))
+
+    def load_compiled(self, actions):
+        path = Map.cache_path(self, actions)
+        if os.path.exists(path):
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in COMPILED}
+            return Transitions(self.width, self.height, self.walls, actions, compiled=arrays)
+
+        # Compile the map, and write the arrays to the cache (through a temporary file, as other processes may be
+        # reading the same cache)
+        transitions = Transitions(self.width, self.height, self.walls, actions)
+        transitions.goal_cells = np.array([transitions.cell(x, y) for ((x, y), g_id) in self.goals], dtype=np.int64)
+        transitions.start_cells = np.array([transitions.cell(x, y) for (x, y) in self.starts], dtype=np.int64)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp = path[:-len(".npz")] + ".%d.tmp.npz" % os.getpid()
+        np.savez(temp, **{name: getattr(transitions, name) for name in COMPILED})
+        os.replace(temp, path)
+        return transitions
+
+
+# The names of every map in the registry
+def map_names():
+    return sorted(f[:-len(".json")] for f in os.listdir(MAP_DIR) if f.endswith(".json"))
+
+
+# Read a map by name (once per process, unless its file has changed since)
+def read_map(name):
+    path = os.path.join(MAP_DIR, name + ".json")
+    if not os.path.exists(path):
+        raise ValueError("There is no map %r (the maps are %s)" % (name, ", ".join(map_names())))
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if name not in loaded or loaded[name].digest != digest:
+        loaded[name] = Map(name, data, digest)
+    return loaded[name]
@@ -0,0 +1,166 @@
+__author__ = 'Dylan Klein'
+'''This file runs the STAGE_1 scenarios headless, spreading scenarios and seeds over a pool of worker processes'''
+
+from STAGE_1.Make_World import Grid_World
+from STAGE_1.Agents import Q_Learner
+from STAGE_1.Map_Registry import read_map
+import multiprocessing as mp
+import numpy as np
+import argparse
+import random
+import json
+import time
+import ast
+import os
+
+ENV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "envs")
+
+
+'''
+    *** HEADLESS RUNNER ***
+    - A run trains one scenario (an env script in STAGE_1/envs) from one seed, exactly as its script does (the same
+      map, Q_Learners, turn order and number of episodes) but with no window and no slow-downs
+    - Every (scenario, seed) run is independent, so the runs are shared out over a pool of worker processes
+    - A run reports its throughput (steps and episodes per second) and its learning curve: every agent's mean reward
+      per episode, and the collisions per episode, over each window of 'window' episodes
+'''
+
+
+# The scenarios in STAGE_1/envs
+def scenario_names():
+    return sorted(f[:-len(".py")] for f in os.listdir(ENV_DIR) if f.endswith(".py") and not f.startswith("_"))
+
+
+# The settings of a scenario: its map (from the map registry), and its agents' exploit period and number of
+# episodes (read from its script without running it, as the scripts open a window and train when imported)
+def read_scenario(name):
+    found = {"map": read_map(name), "exploit_period": 50, "episodes": 5000}
+    with open(os.path.join(ENV_DIR, name + ".py")) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "Q_Learner":
+            keywords = {k.arg: k.value for k in node.keywords}
+            found["exploit_period"] = ast.literal_eval(keywords["exploit_period"])
+        elif isinstance(node, ast.While) and isinstance(node.test, ast.Compare):
+            found["episodes"] = ast.literal_eval(node.test.comparators[0])  # while episode < 5000:
+    return found
+
+
+# Train one scenario from one seed (in a worker process)
+def run_scenario(job):
+    (name, seed, episodes, window) = job
+    scenario = read_scenario(name)
+    if episodes is None:
+        episodes = scenario["episodes"]
+    random.seed(seed)
+
+    start = time.perf_counter()
+    m = scenario["map"]
+    env = Grid_World(width=m.width, height=m.height, initial_state=m.init_state, walls=m.walls, specials=m.specials,
+                     render_mode="none")
+    agents = [Q_Learner(agent_id=i + 1, discount=0.3, exploit_period=scenario["exploit_period"], q={}, env=env)
+              for i in range(env.num_agents)]
+    startup = time.perf_counter() - start
+
+    # Every agent's reward and the collisions in each episode
+    rewards = np.zeros((episodes, env.num_agents))
+    collisions = np.zeros(episodes, dtype=np.int64)
+    last = np.zeros(env.num_agents)
+
+    start = time.perf_counter()
+    observation = env.reset()
+    (done, episode, t, steps) = (False, 1, 1, 0)
+    while episode < episodes:
+
+        # Agents take turns from a random first agent, as in the env scripts
+        i = random.randint(0, env.num_agents - 1)
+        for n in range(env.num_agents):
+            observation, done, episode = agents[(i + n) % env.num_agents].step(time=t, s=observation)
+        t += 1
+        steps += 1
+
+        if done is True:
+            totals = np.array([agent.cumulative_reward for agent in agents])
+            rewards[episode - 1] = totals - last
+            collisions[episode - 1] = env.collisions
+            last = totals
+            observation = env.reset()
+            t = 1
+    elapsed = time.perf_counter() - start
+
+    # Episodes are numbered from 1, and the last one is never finished
+    (rewards, collisions) = (rewards[:episodes - 1], collisions[:episodes - 1])
+    windows = len(rewards) // window
+    curve = rewards[:windows * window].reshape(windows, window, env.num_agents).mean(axis=1)
+    collision_curve = collisions[:windows * window].reshape(windows, window).mean(axis=1)
+    return {"scenario": name, "seed": seed, "num_agents": env.num_agents, "episodes": len(rewards), "steps": steps,
+            "startup_s": startup, "seconds": elapsed, "steps_per_s": steps / elapsed,
+            "episodes_per_s": len(rewards) / elapsed, "window": window, "reward_curve": curve.tolist(),
+            "collision_curve": collision_curve.tolist(),
+            "final_reward": curve[-1].tolist() if windows else rewards.mean(axis=0).tolist()}
+
+
+# Run every job over a pool of 'workers' processes, printing each run as it finishes
+def run_all(jobs, workers):
+    results = []
+    with mp.Pool(workers) as pool:
+        for result in pool.imap_unordered(run_scenario, jobs):
+            results.append(result)
+            print("%-18s seed %-4d %8.0f steps/s %8.1f s  final reward per episode %s"
+                  % (result["scenario"], result["seed"], result["steps_per_s"], result["seconds"],
+                     " ".join("%.2f" % r for r in result["final_reward"])))
+    results.sort(key=lambda r: (r["scenario"], r["seed"]))
+    return results
+
+
+# Print every scenario's throughput and learning curve (the mean over its seeds and agents), 'points' windows wide
+def report(results, points=10):
+    print()
+    print("%-18s %5s %10s %10s %10s %9s  %s" % ("scenario", "seeds", "steps/s", "episodes/s", "seconds", "final",
+                                              "mean reward per episode over training"))
+    for name in sorted(set(r["scenario"] for r in results)):
+        runs = [r for r in results if r["scenario"] == name]
+        curve = np.mean([np.mean(r["reward_curve"], axis=1) for r in runs], axis=0) if runs[0]["reward_curve"] else []
+        shown = curve[np.linspace(0, len(curve) - 1, min(points, len(curve))).astype(int)] if len(curve) else []
+        final = np.mean([np.mean(r["final_reward"]) for r in runs])
+        print("%-18s %5d %10.0f %10.0f %10.1f %9.2f  %s"
+              % (name, len(runs), np.mean([r["steps_per_s"] for r in runs]),
+                 np.mean([r["episodes_per_s"] for r in runs]), sum(r["seconds"] for r in runs), final,
+                 " ".join("%.2f" % c for c in shown)))
+
+
+'''
+    *** MAIN PROGRAM ***
+    From the repository directory:
+        python -m STAGE_1.Runner                                    # Every scenario, seed 0
+        python -m STAGE_1.Runner Side_Street Roundabout --seeds 4   # Two scenarios, seeds 0-3
+        python -m STAGE_1.Runner --episodes 1000 --out runs.json    # A quick check of every scenario
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run STAGE_1 scenarios headless across a pool of processes")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default: all of %s)" % ", ".join(scenario_names()))
+    parser.add_argument("--seeds", type=int, default=1, help="runs per scenario, seeded 0, 1, ...")
+    parser.add_argument("--episodes", type=int, default=None, help="episodes per run (default: as in each script)")
+    parser.add_argument("--window", type=int, default=100, help="episodes per point of the learning curves")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--out", default=None, help="JSON file to write every run's results and curves to")
+    args = parser.parse_args()
+
+    names = args.scenarios or scenario_names()
+    for name in names:
+        if name not in scenario_names():
+            parser.error("unknown scenario %r (the scenarios are %s)" % (name, ", ".join(scenario_names())))
+
+    # The slowest runs (the most agents) go first, so that they never hold up the end of the pool
+    jobs = [(name, seed, args.episodes, args.window) for name in names for seed in range(args.seeds)]
+    jobs.sort(key=lambda job: -len(read_map(job[0]).starts))
+
+    start = time.perf_counter()
+    results = run_all(jobs, min(args.workers, len(jobs)))
+    report(results)
+    print("%d runs in %.1f s" % (len(results), time.perf_counter() - start))
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
@@ -1,54 +1,77 @@
 __author__ = 'Dylan'
 
+from itertools import product
+from operator import mul
 
-# This function generates a grid state space with multiple agents (1-5)
-def make_states(n, x, y):
 
-    state_space = []
-
-    if n == 1:
-        for a in range(x):
-            for b in range(y):
-                state_space.append((a, b))
-
-    elif n == 2:
-        for a in range(x):
-            for b in range(y):
-                for c in range(x):
-                    for d in range(y):
-                        state_space.append((a, b, c, d))
-
-    elif n == 3:
-        for a in range(x):
-            for b in range(y):
-                for c in range(x):
-                    for d in range(y):
-                        for e in range(x):
-                            for f in range(y):
-                                state_space.append((a, b, c, d, e, f))
-
-    elif n == 4:
-        for a in range(x):
-            for b in range(y):
-                for c in range(x):
-                    for d in range(y):
-                        for e in range(x):
-                            for f in range(y):
-                                for g in range(x):
-                                    for h in range(y):
-                                        state_space.append((a, b, c, d, e, f, g, h))
-
-    elif n == 5:
-        for a in range(x):
-            for b in range(y):
-                for c in range(x):
-                    for d in range(y):
-                        for e in range(x):
-                            for f in range(y):
-                                for g in range(x):
-                                    for h in range(y):
-                                        for i in range(x):
-                                            for j in range(y):
-                                                state_space.append((a, b, c, d, e, f, g, h, i, j))
-
-    return state_space
+
+class State_Space:
+    """
+        A lazy grid state space. No state tuples are stored: each state is a digit in a mixed-radix number, so a
+        state maps to a dense integer index (and back) with a handful of multiplications.
+            - 'lows' is the smallest value each state variable can take
+            - 'highs' is one past the largest value each state variable can take
+        Indices follow the order of the old nested loops, i.e. the last state variable varies fastest.
+    """
+
+    def __init__(self, lows, highs):
+
+        self.lows = tuple(lows)  # Smallest value of each state variable
+        self.highs = tuple(highs)  # One past the largest value of each state variable
+        self.radices = tuple(h - l for (l, h) in zip(self.lows, self.highs))  # Number of values per state variable
+
+        # Place value of each state variable in the mixed-radix index
+        strides = []
+        stride = 1
+        for radix in reversed(self.radices):
+            strides.append(stride)
+            stride *= radix
+        self.strides = tuple(reversed(strides))
+        self.size = stride  # The number of states, found without enumerating them
+        self.offset = sum(l * s for (l, s) in zip(self.lows, self.strides))  # Index contribution of the lows
+
+    def __len__(self):
+        return self.size
+
+    # Iterate over state tuples lazily, in index order
+    def __iter__(self):
+        return product(*[range(l, h) for (l, h) in zip(self.lows, self.highs)])
+
+    def __contains__(self, state):
+        if len(state) != len(self.radices):
+            return False
+        for (v, l, h) in zip(state, self.lows, self.highs):
+            if not l <= v < h:
+                return False
+        return True
+
+    def __getitem__(self, index):
+        return State_Space.state(self, index)
+
+    # Map a state tuple to its integer index
+    def index(self, state):
+        if state not in self:
+            raise ValueError(str(state) + " is not in the state space")
+        return State_Space.encode(self, state)
+
+    # Map a state tuple that is known to be valid to its integer index (no bounds checks, for the inner loop)
+    def encode(self, state):
+        return sum(map(mul, state, self.strides)) - self.offset
+
+    # Map an integer index back to its state tuple
+    def state(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("state index " + str(index) + " is out of range")
+        state = []
+        for (l, r, s) in zip(self.lows, self.radices, self.strides):
+            state.append(l + (index // s) % r)
+        return tuple(state)
+
+
+# This function generates a grid state space with any number of agents
+def make_states(n, x, y):
+    lows = [0, 0] * n
+    highs = [x, y] * n
+    return State_Space(lows, highs)
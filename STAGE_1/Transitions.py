@@ -0,0 +1,66 @@
+__author__ = 'Dylan Klein'
+'''This file compiles the geometry of a grid world into lookup tables for moving agents'''
+
+import numpy as np
+
+
+# Incremental changes in x,y coordinates of each action
+MOVES = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0), "none": (0, 0)}
+
+
+class Transitions:
+    """
+        A map compiled once so that every move is a single indexed lookup.
+        Cells are numbered row by row, i.e. cell = y * width + x.
+            - 'next_cell[cell, action]' is the cell an agent ends up in (its own cell if the move is blocked)
+            - 'blocked[cell, action]' is True if the move runs into a wall or off the edge of the world
+        The '_list' copies hold the same tables as nested lists, which are quicker than NumPy for the one-element
+        lookups of a single environment step; the arrays are for vectorised code.
+        'compiled' takes the arrays of an earlier compilation (see Map_Registry.py) instead of compiling again.
+    """
+
+    def __init__(self, width, height, walls, actions, compiled=None):
+
+        self.width = width
+        self.height = height
+        self.num_cells = width * height
+        self.action_index = {a: i for (i, a) in enumerate(actions)}  # To map actions to column indices
+
+        if compiled is not None:
+            for (name, array) in compiled.items():
+                setattr(self, name, array)
+        else:
+            Transitions.compile(self, walls, actions)
+
+        self.next_cell_list = self.next_cell.tolist()
+        self.blocked_list = self.blocked.tolist()
+        self.cell_xy_list = [tuple(xy) for xy in self.cell_xy.tolist()]
+
+    # Compile the wall mask and every (cell, action) pair
+    def compile(self, walls, actions):
+        (width, height) = (self.width, self.height)
+
+        # The coordinates of each cell, and the mask of wall cells
+        self.cell_xy = np.array([(c % width, c // width) for c in range(self.num_cells)], dtype=np.int64)
+        self.wall_mask = np.zeros(self.num_cells, dtype=bool)
+        for (x, y) in walls:
+            self.wall_mask[y * width + x] = True
+
+        # Compile every (cell, action) pair
+        self.next_cell = np.zeros((self.num_cells, len(actions)), dtype=np.int64)
+        self.blocked = np.zeros((self.num_cells, len(actions)), dtype=bool)
+        for c in range(self.num_cells):
+            (x, y) = self.cell_xy[c]
+            for (i, a) in enumerate(actions):
+                (dx, dy) = MOVES[a]
+                (new_x, new_y) = (x + dx, y + dy)
+                if (new_x >= 0) and (new_x < width) and (new_y >= 0) and (new_y < height) and \
+                        not self.wall_mask[new_y * width + new_x]:
+                    self.next_cell[c, i] = new_y * width + new_x
+                else:
+                    self.next_cell[c, i] = c
+                    self.blocked[c, i] = True
+
+    # The cell number of a pair of coordinates
+    def cell(self, x, y):
+        return y * self.width + x
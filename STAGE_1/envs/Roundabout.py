@@ -3,40 +3,19 @@ __author__ = 'Dylan Klein'
 
 from STAGE_1.Make_World import Grid_World
 from STAGE_1.Agents import Q_Learner
+from STAGE_1.Map_Registry import read_map
 import threading
 import time
 from random import *
 
 
-''' 
-    *** DEFINE THE WALL CELLS OF THE WORLD ***
-        'walls' is defined as a list with entries in the following syntax:
-            (x, y) where
-                x = x_coordinate of cell
-                y = y_coordinate of cell
-'''
-walls = [(0, 0), (1, 0),       (3, 0), (4, 0),
-         (0, 1),                       (4, 1),
-                        (2, 2),
-         (0, 3),                       (4, 3),
-         (0, 4), (1, 4),       (3, 4), (4, 4)]
-
-
 '''
-    *** DEFINE THE SPECIAL CELLS OF THE WORLD ***
-        'specials' is defined as a list with entries in the following syntax:
-            (a_id, (x, y), c, r) where
-                a_id = agent_id (if a_id = 0, this indicates that the special cell is common to all agents)
-                x = x_coordinate of cell
-                y = y_coordinate of cell
-                c = colour of cell (red or green)
-                r = reward of cell
+    *** LOAD THE MAP ***
+        The walls, special cells and agents' starting cells are read from Maps/Roundabout.json
+        (see STAGE_1/Map_Registry.py for the format)
 '''
+scenario = read_map("Roundabout")
 
-specials = [(1, (2, 0), "green", 5),
-            (2, (4, 2), "green", 5),
-            (3, (2, 4), "green", 5),
-            (4, (0, 2), "green", 5)]
 
 '''
     *** CREATE AN ENVIRONMENT OBJECT ***
@@ -44,8 +23,8 @@ specials = [(1, (2, 0), "green", 5),
         - initial_state is defined as a tuple with agents' initial position coordinates written in order,
         for example if Agent A starts at (0, 0) and Agent B starts at (2, 4) then initial_state = (0, 0, 2, 4)
 '''
-init_state = (2, 4, 0, 2, 2, 0, 4, 2)
-env = Grid_World(width=5, height=5, initial_state=init_state, walls=walls, specials=specials)
+env = Grid_World(width=scenario.width, height=scenario.height, initial_state=scenario.init_state,
+                 walls=scenario.walls, specials=scenario.specials)
 
 ''' 
     *** INITIALISE THE ENVIRONMENT ***
@@ -2,44 +2,71 @@ __author__ = 'Dylan Klein'
 '''This file defines the class for creating agents who learn to navigate and negotiate in a multi-agent environment'''
 
 from Naming_Convention import integer_to_letter as int2let
+from Checkpoint import read_checkpoint, write_checkpoint, EXTENSION
+from Page_Store import Page_Store
+from Replay import Replay_Buffer
 from random import *
+from collections import OrderedDict
+import numpy as np
 import copy
+import os
 import pickle
-# import tensorflow as tf
 
 
 class Q_Table:
 
-    def __init__(self, agent_id, discount, epsilon_decay, actions, q):
+    def __init__(self, agent_id, discount, epsilon_decay, actions, q, shared=False, states=None):
 
         self.agent_id = agent_id  # Numerical ID for each agent
         self.discount = discount  # Discount factor
         self.alpha = 0.1  # The agent's learning rate
+        self.alpha_power = 0.1  # The learning rate decays as time ** -alpha_power
         self.epsilon = 0.1  # Initial value of agent's epsilon
         self.epsilon_decay = epsilon_decay  # How much epsilon decays per step
-        self.Q = copy.deepcopy(q)  # The Q-table of the agent
+        self.shared = shared  # If True, 'q' is used as is so that it can be read and updated by every agent
+        self.Q = q if shared else copy.deepcopy(q)  # The Q-table of the agent
         self.actions = actions  # Input the environment's action space
         self.action = "none"  # The agent's chosen action for a single step
         self.goal = (0, 0, 0, 0)  # An agent's goal in one-hot coding
         self.intent = "none"  # An agent's intended goal in words
         self.position = (0, 0)  # An agent's coordinates
+        self.cell = 0  # An agent's cell number in the map's transition tables
         self.reward = 0  # An agent's reward per step
-        self.state = []  # An agent's previous state
-        self.state2 = []  # An agent's new state
+        self.state = 0  # An agent's previous state (its integer index in the state space)
+        self.state2 = 0  # An agent's new state
+        self.states = states  # The environment's state space (to read tables saved with state tuples as keys)
+        self.in_memory = True  # The table is held in memory (so a forked process sees a frozen copy of it)
 
         # The initial Q-table of the agent is to be loaded from file if input is not {}
         if self.Q == "load":
             Q_Table.load(self)
 
-    # Load Q-table from file
+    # Load Q-table from file (an older table keyed by state tuples is re-keyed by state index)
     def load(self):
         with open('Saved_Files/' + 'agent' + int2let(self.agent_id+1) + '_saved' + '.pkl', 'rb') as f:
             self.Q = pickle.load(f)
+        if isinstance(next(iter(self.Q), None), tuple):
+            self.Q = {self.states.index(state): values for (state, values) in self.Q.items()}
 
-    # Save Q-table to file
-    def save(self):
-        with open('Saved_Files/' + 'agent' + int2let(self.agent_id+1) + '_saved' + '.pkl', 'wb') as f:
-            pickle.dump(self.Q, f, pickle.HIGHEST_PROTOCOL)
+    # Save Q-table (or a snapshot of it) to file, through a temporary file so that a crash never leaves half a table
+    def save(self, directory='Saved_Files', table=None):
+        path = directory + '/' + 'agent' + int2let(self.agent_id+1) + '_saved' + '.pkl'
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self.Q if table is None else table, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    # Copy the Q-table, so that the copy can be saved while training carries on
+    def snapshot(self):
+        return {s: dict(values) for (s, values) in self.Q.items()}
+
+    # Let go of a snapshot once it has been saved (a copy in memory needs nothing done)
+    def release(self, table):
+        pass
+
+    # Set the Q-values of some rows of the table (e.g. to start from a plan, see Planner.py)
+    def set_rows(self, states, values):
+        for (s, row) in zip(states.tolist(), values.tolist()):
+            self.Q[s] = dict(zip(self.actions, row))
 
     # Decide on the best action to take (with the exception of a random action now and again)
     def act(self):
@@ -63,7 +90,7 @@ class Q_Table:
         Q_Table.inc_Q(self, self.state, self.action, self.alpha, self.reward + self.discount * max_val)
 
         # Update the learning rate
-        self.alpha = pow(time, -0.1)
+        self.alpha = pow(time, -self.alpha_power)
 
         # Decay epsilon value at the end of each episode
         if restart is True and self.epsilon > 0.01:
@@ -85,25 +112,490 @@ class Q_Table:
         self.Q[s][a] += alpha * inc
 
 
+class Q_Array(Q_Table):
+    """
+        A Q-table stored as one contiguous float32 array of shape (num_states, num_actions).
+        Rows are indexed by the integer index of a state in the environment's state space and columns by the
+        position of an action in the action space, so every lookup and update is a single array operation.
+        learn keeps the best action it finds for the new state, and act reuses it when the agent has not been moved
+        since. Even so, NumPy's per-call overhead on a row of 5 Q-values makes a step about as fast as a "Q_Table"
+        step, not faster: the array pays off in memory (4 bytes per Q-value), startup, checkpoints and batched
+        updates. Tables are saved as checkpoints (see Checkpoint.py), which load through a copy-on-write memory map.
+        With 'replay_size' > 0, every transition is also stored in a replay buffer, and each learning step is followed
+        by 'replay_batch' updates from transitions drawn from it, applied to the table as one vectorised batch.
+        With alpha_schedule="visits", 'visits' counts the updates of every state-action pair in a uint32 array of the
+        table's shape, and each update uses the learning rate 1 / (1 + n) ** visit_power, where n is the pair's count
+        before the update (instead of time ** -alpha_power for every pair). The counts are saved next to the table,
+        and visit_stats() summarises them.
+    """
+
+    def __init__(self, agent_id, discount, epsilon_decay, actions, q, states, shared=False, header=None,
+                 replay_size=0, replay_batch=0, alpha_schedule="time", visit_power=0.8):
+
+        Q_Table.__init__(self, agent_id, discount, epsilon_decay, actions, {}, shared, states)
+        self.action_index = {a: i for (i, a) in enumerate(actions)}  # To map actions to column indices
+        self.header = header  # The environment's description, saved with the table and checked against it on load
+        self.replay = Replay_Buffer(replay_size) if replay_size > 0 else None  # The agent's replay memory, if any
+        self.replay_batch = replay_batch  # Replayed updates per learning step
+        self.alpha_schedule = alpha_schedule  # "time": the learning rate decays with time, "visits": with visits
+        self.visit_power = visit_power  # How fast the learning rate of a pair decays with its visits
+        self.visits = None  # The update count of every state-action pair (with alpha_schedule="visits")
+        self.greedy_state = -1  # The state whose best action learn last found (-1 when there is none to reuse)
+        self.greedy = 0  # The column of that best action
+
+        # The initial Q-table of the agent is to be loaded from file if input is "load"
+        if isinstance(q, str) and q == "load":
+            Q_Array.load(self)
+        elif shared:
+            self.Q = np.asarray(q, dtype=np.float32)
+        else:
+            self.Q = np.array(q, dtype=np.float32)
+        if self.alpha_schedule == "visits" and self.visits is None:
+            self.visits = np.zeros(self.Q.shape, dtype=np.uint32)
+
+    # Load Q-table from file: a checkpoint is mapped into memory (updates stay private to this process), while an
+    # older .npy array or dict-of-dicts pickle is read and converted on the fly
+    def load(self):
+        name = 'Saved_Files/' + 'agent' + int2let(self.agent_id+1) + '_saved'
+        if os.path.exists(name + EXTENSION):
+            header, table = read_checkpoint(name + EXTENSION, expected=self.header, mode="c")
+            self.Q = table.view(np.ndarray)  # A plain array view of the map skips np.memmap's per-call overhead
+        elif os.path.exists(name + '.npy'):
+            self.Q = np.load(name + '.npy')
+        else:
+            Q_Table.load(self)
+            self.Q = Q_Array.from_dict(self.Q, self.states, self.actions)
+        if self.alpha_schedule == "visits" and os.path.exists(name + '_visits.npy'):
+            self.visits = np.load(name + '_visits.npy')
+
+    # Save Q-table (or a snapshot of it) to file as a checkpoint, along with the visit counts if there are any
+    def save(self, directory='Saved_Files', table=None):
+        name = directory + '/' + 'agent' + int2let(self.agent_id+1) + '_saved'
+        (table, visits) = table if isinstance(table, tuple) else (table, self.visits)
+        write_checkpoint(name + EXTENSION, self.Q if table is None else table, self.header)
+        if visits is not None:
+            with open(name + '_visits.npy.tmp', 'wb') as f:
+                np.save(f, visits)
+            os.replace(name + '_visits.npy.tmp', name + '_visits.npy')
+
+    # Copy the Q-table (and visit counts), so that the copy can be saved while training carries on
+    def snapshot(self):
+        if self.visits is not None:
+            return self.Q.copy(), self.visits.copy()
+        return self.Q.copy()
+
+    # Set the Q-values of some rows of the table
+    def set_rows(self, states, values):
+        self.Q[states] = values
+        self.greedy_state = -1
+
+    # Convert a dict-of-dicts Q-table into the array layout
+    @staticmethod
+    def from_dict(q, states, actions):
+        table = np.full((len(states), len(actions)), 0.1, dtype=np.float32)
+        for (state, values) in q.items():
+            table[states.index(state) if isinstance(state, tuple) else state] = [values[a] for a in actions]
+        return table
+
+    # Decide on the best action to take (with the exception of a random action now and again)
+    def act(self):
+
+        # Do a random action
+        if random() < self.epsilon:
+            self.action = self.actions[randint(0, 4)]
+
+        # Do the best action (found by learn at the end of the last step, if the state has not changed since)
+        elif self.state == self.greedy_state:
+            self.action = self.actions[self.greedy]
+        else:
+            self.action = self.actions[self.Q[self.state].argmax()]
+
+    # Learn from the new state and reward pair as updated by the environment
+    def learn(self, time, restart):
+
+        # Count the visit, and set the pair's learning rate from its count
+        a = self.action_index[self.action]
+        if self.visits is not None:
+            n = self.visits.item(self.state, a) + 1
+            self.visits[self.state, a] = n
+            self.alpha = n ** -self.visit_power
+
+        # Update Q
+        s2 = self.state2
+        g = self.Q[s2].argmax()
+        Q_Array.inc_Q(self, self.state, a, self.alpha, self.reward + self.discount * self.Q.item(s2, g))
+
+        # Keep the best action of the new state for the next act, unless the update may have changed it (a table
+        # other agents update is never cached)
+        self.greedy_state = s2 if self.state != s2 and not self.shared else -1
+        self.greedy = g
+
+        # Replay earlier transitions
+        if self.replay is not None:
+            self.replay.add(self.state, a, self.reward, s2, restart)
+            if len(self.replay) >= self.replay_batch > 0:
+                Q_Array.replay_update(self)
+                self.greedy_state = -1
+
+        # Update the learning rate
+        if self.visits is None:
+            self.alpha = pow(time, -self.alpha_power)
+
+        # Decay epsilon value at the end of each episode
+        if restart is True and self.epsilon > 0.01:
+            self.epsilon *= self.epsilon_decay
+
+    # Update the table from a minibatch of replayed transitions at once (if a state-action pair is drawn more than once,
+    # one of its updates is kept, as if it had been drawn once). The contiguous table is indexed through its flat view
+    # with take, which is quicker than 2-D fancy indexing on batches this small
+    def replay_update(self):
+        (s, a, r, s2, done) = self.replay.sample(self.replay_batch)
+        flat = s * self.Q.shape[1] + a
+        table = self.Q.reshape(-1)
+        q = table.take(flat)
+        alpha = self.alpha
+        if self.visits is not None:
+            counts = self.visits.reshape(-1)
+            n = counts.take(flat) + 1
+            counts[flat] = n
+            alpha = n ** -self.visit_power
+        table[flat] = q + alpha * (r + self.discount * self.Q.take(s2, axis=0).max(axis=1) - q)
+
+    # Summarise the visit counts: how much of the table has been updated, and how often
+    def visit_stats(self):
+        if self.visits is None:
+            return None
+        visited = self.visits[self.visits > 0]
+        (rows, cols) = self.visits.shape
+        states = int(np.count_nonzero(self.visits.any(axis=1)))
+        quantiles = np.percentile(visited, [50, 90, 99]).tolist() if visited.size else [0, 0, 0]
+        return {"updates": int(self.visits.sum(dtype=np.int64)), "visited_pairs": int(visited.size),
+                "pair_fraction": visited.size / (rows * cols), "visited_states": states,
+                "state_fraction": states / rows,
+                "max": int(visited.max()) if visited.size else 0, "median": quantiles[0], "p90": quantiles[1],
+                "p99": quantiles[2]}
+
+    # Find the maximum Q-value and action pair for a given row index
+    # (argmax and item are used as a reduction like max() costs several times more on a row this short)
+    def max_Q(self, s):
+        a = self.Q[s].argmax()
+        return self.actions[a], self.Q.item(s, a)
+
+    # Update the Q-value at a row and column index based on the learning rate
+    def inc_Q(self, s, a, alpha, inc):
+        q = self.Q.item(s, a)
+        self.Q[s, a] = q + alpha * (inc - q)
+
+
+class Q_Sparse(Q_Table):
+    """
+        A dict-of-dicts Q-table whose rows are only created the first time a state is visited (with every Q-value
+        set to 0.1), so memory scales with the states actually reached rather than the whole state space.
+        If 'max_rows' is given, the least recently used rows are evicted once the table holds more rows than that,
+        and an evicted state starts again from 0.1 if it is ever revisited.
+    """
+
+    def __init__(self, agent_id, discount, epsilon_decay, actions, q, states, max_rows=None, shared=False):
+
+        Q_Table.__init__(self, agent_id, discount, epsilon_decay, actions, q, shared, states)
+        if not (shared and isinstance(self.Q, OrderedDict)):
+            self.Q = OrderedDict(self.Q)  # Rows are kept in least to most recently used order
+        self.max_rows = max_rows  # The most rows to keep before evicting cold ones (None to never evict)
+        self.evictions = 0  # To count how many rows have been evicted
+
+        # A state's row must survive while its successor's row is created in learn
+        if self.max_rows is not None and self.max_rows < 2:
+            raise ValueError("max_rows must be at least 2")
+
+    # Create the row of a state on first touch and mark it as the most recently used
+    def touch(self, s):
+        if s in self.Q:
+            if self.max_rows is not None:
+                self.Q.move_to_end(s)
+        else:
+            self.Q[s] = dict.fromkeys(self.actions, 0.1)
+            if self.max_rows is not None and len(self.Q) > self.max_rows:
+                self.Q.popitem(last=False)
+                self.evictions += 1
+
+    # Set the Q-values of some rows of the table (the last rows set are the most recently used)
+    def set_rows(self, states, values):
+        Q_Table.set_rows(self, states, values)
+        while self.max_rows is not None and len(self.Q) > self.max_rows:
+            self.Q.popitem(last=False)
+            self.evictions += 1
+
+    # Decide on the best action to take (with the exception of a random action now and again)
+    def act(self):
+        Q_Sparse.touch(self, self.state)
+        Q_Table.act(self)
+
+    # Learn from the new state and reward pair as updated by the environment
+    def learn(self, time, restart):
+        Q_Sparse.touch(self, self.state2)
+        Q_Table.learn(self, time, restart)
+
+    # Report how many rows have been allocated, compared with the size of the full state space
+    def occupancy(self):
+        return {"rows": len(self.Q),
+                "states": len(self.states),
+                "fraction": len(self.Q) / len(self.states),
+                "evictions": self.evictions}
+
+
+class Q_Paged(Q_Array):
+    """
+        A Q-table too large for memory, kept on disk in a Page_Store and paged in and out of 'memory_budget' bytes.
+        The store reads and writes like the array of a "Q_Array" agent, so acting and learning are unchanged;
+        store.stats() reports the cache hit rate for sizing the budget.
+    """
+
+    def __init__(self, agent_id, discount, epsilon_decay, actions, q, states, shared=False, header=None,
+                 memory_budget=64 * 2**20, page_rows=1024):
+
+        Q_Table.__init__(self, agent_id, discount, epsilon_decay, actions, {}, shared, states)
+        self.action_index = {a: i for (i, a) in enumerate(actions)}  # To map actions to column indices
+        self.header = header  # The environment's description, saved with the table and checked against it on load
+        self.replay = None  # A store is not read in batches, so it does not replay transitions
+        self.visits = None  # Nor does it count visits (the counts would be as large as the table)
+        self.in_memory = False  # The table is in a file that training keeps writing to
+        self.greedy_state = -1  # The state whose best action learn last found (-1 when there is none to reuse)
+        self.greedy = 0  # The column of that best action
+
+        # Use a shared agent's store, or create a store (loading it from file if q is "load")
+        if isinstance(q, Page_Store):
+            self.Q = q
+        else:
+            self.Q = Page_Store(len(states), len(actions), header, memory_budget, page_rows,
+                                prefix='agent' + int2let(self.agent_id+1) + '_')
+            if isinstance(q, str) and q == "load":
+                Q_Paged.load(self)
+
+    # Set the Q-values of some rows of the store
+    def set_rows(self, states, values):
+        for (s, row) in zip(states.tolist(), values.tolist()):
+            for (a, value) in enumerate(row):
+                self.Q[s, a] = value
+        self.greedy_state = -1
+
+    # Load Q-table from a checkpoint file into the store
+    def load(self):
+        self.Q.load('Saved_Files/' + 'agent' + int2let(self.agent_id+1) + '_saved' + EXTENSION)
+
+    # Save Q-table (or a snapshot of it) to file as a checkpoint
+    def save(self, directory='Saved_Files', table=None):
+        path = directory + '/' + 'agent' + int2let(self.agent_id+1) + '_saved' + EXTENSION
+        if table is None:
+            self.Q.save(path)
+        else:
+            self.Q.copy_pages(path, table)
+
+    # Flush the store and freeze its file until the snapshot is released (a whole table cannot be copied into
+    # memory), returning the pages the file holds
+    def snapshot(self):
+        return self.Q.begin_copy()
+
+    # Let training write to the store's file again once the snapshot has been saved
+    def release(self, table):
+        self.Q.end_copy()
+
+
 class DQN:
+    """
+        A deep Q-network in plain NumPy, so it runs on any CPU without TensorFlow or a GPU.
+            - The input is the state index decoded into its state variables, each one-hot encoded, so the network
+              (and its memory) grows with the number of state variables, not the number of states
+            - A multi-layer perceptron with ReLU hidden layers of sizes 'hidden' outputs one Q-value per action
+            - Every step, the transition is stored in a replay buffer and a minibatch of 'batch_size' transitions
+              trains the network with Adam, with the forward and backward passes batched over the minibatch
+            - Targets come from a copy of the network synced every 'target_sync' learning steps
+            - TD errors are clipped to [-1, 1] (a Huber loss), as rewards range from -10 to 5
+        The weights, target weights and Adam moments are each one flat array (so Adam updates every layer in a few
+        array operations), held in the dict 'self.Q'; agents sharing the dict share one network, and it is saved to
+        file with np.savez. 'self.layers' and 'self.target' are (weights, biases) views into the flat arrays.
+    """
 
-    def __init__(self, agent_id, discount, epsilon_decay, actions, num_states, q):
+    def __init__(self, agent_id, discount, epsilon_decay, actions, states, q, shared=False, hidden=(64, 64),
+                 learning_rate=0.001, batch_size=32, replay_size=20000, target_sync=500):
 
         self.agent_id = agent_id  # Numerical ID for each agent
         self.discount = discount  # Discount factor
+        self.alpha = learning_rate  # The agent's learning rate (a constant step size for Adam)
+        self.epsilon = 0.1  # Initial value of agent's epsilon
         self.epsilon_decay = epsilon_decay  # How much epsilon decays per step
+        self.shared = shared  # If True, 'q' is used as is so that every agent trains one network
         self.actions = actions  # Input the environment's action space
-        self.num_states = num_states  # Input the size of the environment's state space
-
-        # These lines establish the feed-forward part of the network used to choose actions
-        num_actions = len(self.actions)
-        inputs1 = tf.placeholder(shape=[1, self.num_states], dtype=tf.float32)
-        W = tf.Variable(tf.random_uniform([self.num_states, num_actions], 0, 0.01))
-        Qout = tf.matmul(inputs1, W)
-        predict = tf.argmax(Qout, 1)
-
-        # Below we obtain the loss by taking the sum of squares difference between the target and prediction Q-values.
-        nextQ = tf.placeholder(shape=[1, num_actions], dtype=tf.float32)
-        loss = tf.reduce_sum(tf.square(nextQ - Qout))
-        trainer = tf.train.GradientDescentOptimizer(learning_rate=0.1)
-        updateModel = trainer.minimize(loss)
+        self.action = "none"  # The agent's chosen action for a single step
+        self.action_index = {a: i for (i, a) in enumerate(actions)}  # To map actions to output indices
+        self.goal = (0, 0, 0, 0)  # An agent's goal in one-hot coding
+        self.intent = "none"  # An agent's intended goal in words
+        self.position = (0, 0)  # An agent's coordinates
+        self.cell = 0  # An agent's cell number in the map's transition tables
+        self.reward = 0  # An agent's reward per step
+        self.state = 0  # An agent's previous state (its integer index in the state space)
+        self.state2 = 0  # An agent's new state
+        self.in_memory = True  # The network is held in memory (so a forked process sees a frozen copy of it)
+        self.batch_size = batch_size
+        self.target_sync = target_sync
+        self.replay = Replay_Buffer(replay_size)
+
+        # To decode a state index into one input position per state variable
+        self.strides = np.array(states.strides, dtype=np.int64)
+        self.radices = np.array(states.radices, dtype=np.int64)
+        self.input_offsets = np.concatenate([[0], np.cumsum(self.radices)[:-1]])
+        self.sizes = [int(self.radices.sum())] + list(hidden) + [len(actions)]  # Layer widths, input to output
+
+        # Use a shared agent's network, or create one (loading it from file if q is "load")
+        if shared and isinstance(q, dict):
+            self.Q = q
+        elif isinstance(q, str) and q == "load":
+            DQN.load(self)
+        else:
+            self.Q = DQN.new_network(self)
+        self.layers = DQN.unpack(self, self.Q["params"])
+        self.target = DQN.unpack(self, self.Q["target"])
+        self.grads = DQN.unpack(self, np.zeros_like(self.Q["params"]))
+        self.grad = self.grads[0][0].base  # The flat array behind the gradient views
+
+    # Views of the (weights, biases) of every layer in a flat parameter array
+    def unpack(self, flat):
+        layers = []
+        start = 0
+        for (n_in, n_out) in zip(self.sizes[:-1], self.sizes[1:]):
+            W = flat[start:start + n_in * n_out].reshape(n_in, n_out)
+            b = flat[start + n_in * n_out:start + n_in * n_out + n_out]
+            layers.append((W, b))
+            start += n_in * n_out + n_out
+        return layers
+
+    # The number of weights and biases in the network
+    def num_params(self):
+        return sum(n_in * n_out + n_out for (n_in, n_out) in zip(self.sizes[:-1], self.sizes[1:]))
+
+    # Create a network with He-initialised weights, a matching target network and zeroed Adam moments
+    def new_network(self):
+        params = np.zeros(DQN.num_params(self), dtype=np.float32)
+        for (W, b) in DQN.unpack(self, params):
+            W[...] = np.random.randn(*W.shape) * np.sqrt(2 / W.shape[0])
+        return {"params": params, "target": params.copy(), "m": np.zeros_like(params), "v": np.zeros_like(params),
+                "steps": np.zeros(1, dtype=np.int64)}  # Learning steps taken (an array, so that it can be saved)
+
+    # Load the network from file
+    def load(self):
+        with np.load('Saved_Files/' + 'agent' + int2let(self.agent_id+1) + '_saved' + '.npz') as f:
+            self.Q = {name: f[name] for name in f.files}
+        if len(self.Q["params"]) != DQN.num_params(self):
+            raise ValueError("The saved network does not fit this environment's state and action spaces")
+
+    # Save the network (or a snapshot of it) to file, through a temporary file
+    def save(self, directory='Saved_Files', table=None):
+        path = directory + '/' + 'agent' + int2let(self.agent_id+1) + '_saved' + '.npz'
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **(self.Q if table is None else table))
+        os.replace(path + '.tmp', path)
+
+    # Copy the network, so that the copy can be saved while training carries on
+    def snapshot(self):
+        return {name: array.copy() for (name, array) in self.Q.items()}
+
+    # Let go of a snapshot once it has been saved
+    def release(self, table):
+        pass
+
+    # The input positions that are 1 in the one-hot encoding of state indices (one row per state)
+    def active_inputs(self, s):
+        return (np.asarray(s)[..., None] // self.strides) % self.radices + self.input_offsets
+
+    # The Q-values of one state (the first layer of a one-hot input is a sum of rows of its weights)
+    def q_values(self, s):
+        (W, b) = self.layers[0]
+        h = W[DQN.active_inputs(self, s)].sum(axis=0) + b
+        for (W, b) in self.layers[1:]:
+            h = np.maximum(h, 0) @ W + b
+        return h
+
+    # The Q-values of several states at once, one row per state
+    def q_values_batch(self, s):
+        (W, b) = self.layers[0]
+        h = W[DQN.active_inputs(self, s)].sum(axis=1) + b
+        for (W, b) in self.layers[1:]:
+            h = np.maximum(h, 0) @ W + b
+        return h
+
+    # Decide on the best action to take (with the exception of a random action now and again)
+    def act(self):
+
+        # Do a random action
+        if random() < self.epsilon:
+            self.action = self.actions[randint(0, 4)]
+
+        # Do the best action
+        else:
+            self.action = self.actions[DQN.q_values(self, self.state).argmax()]
+
+    # Learn from the new state and reward pair as updated by the environment
+    def learn(self, time, restart):
+
+        # Store the transition, then train on a minibatch of stored transitions
+        self.replay.add(self.state, self.action_index[self.action], self.reward, self.state2, restart)
+        if len(self.replay) >= self.batch_size:
+            DQN.train(self, *self.replay.sample(self.batch_size))
+
+        # Decay epsilon value at the end of each episode
+        if restart is True and self.epsilon > 0.01:
+            self.epsilon *= self.epsilon_decay
+
+    # One Adam step on a minibatch of transitions (the task never ends, so 'done' does not cut off the target)
+    def train(self, s, a, r, s2, done):
+        Q = self.Q
+        last = len(self.layers) - 1
+        rows = np.arange(len(s))
+
+        # One-hot inputs of the states and next states
+        X = np.zeros((len(s), self.sizes[0]), dtype=np.float32)
+        X[rows[:, None], DQN.active_inputs(self, s)] = 1
+        X2 = np.zeros_like(X)
+        X2[rows[:, None], DQN.active_inputs(self, s2)] = 1
+
+        # Targets from the target network
+        h = X2
+        for (i, (W, b)) in enumerate(self.target):
+            h = h @ W + b
+            if i < last:
+                np.maximum(h, 0, out=h)
+        y = r + self.discount * h.max(axis=1)
+
+        # Forward pass, keeping every layer's input for the backward pass
+        inputs = []
+        h = X
+        for (i, (W, b)) in enumerate(self.layers):
+            inputs.append(h)
+            h = h @ W + b
+            if i < last:
+                np.maximum(h, 0, out=h)
+
+        # Backward pass of the clipped TD error of the actions taken, into the flat gradient
+        grad = np.zeros_like(h)
+        grad[rows, a] = np.clip(h[rows, a] - y, -1, 1) / len(s)
+        for i in range(last, -1, -1):
+            (gW, gb) = self.grads[i]
+            np.matmul(inputs[i].T, grad, out=gW)
+            grad.sum(axis=0, out=gb)
+            if i > 0:
+                grad = (grad @ self.layers[i][0].T) * (inputs[i] > 0)
+
+        # Adam, over every parameter at once
+        Q["steps"] += 1
+        t = int(Q["steps"][0])
+        (beta1, beta2) = (0.9, 0.999)
+        step_size = float(self.alpha * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t))
+        (m, v, g) = (Q["m"], Q["v"], self.grad)
+        m *= beta1
+        m += (1 - beta1) * g
+        v *= beta2
+        v += (1 - beta2) * g * g
+        Q["params"] -= step_size * m / (np.sqrt(v) + 1e-8)
+
+        # Sync the target network
+        if t % self.target_sync == 0:
+            np.copyto(Q["target"], Q["params"])
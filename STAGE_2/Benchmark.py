@@ -0,0 +1,227 @@
+__author__ = 'Dylan Klein'
+'''This file measures the step throughput of every environment, agent count and agent backend'''
+
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from Map_Registry import read_map
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # The repository, to import STAGE_1 from
+STAGE_1_ENVS = ["Simple_Game", "Narrow_Street", "Side_Street", "Side_Street_2", "Side_Street_3", "Finding_The_Gap_1",
+                "Roundabout"]
+STAGE_2_BACKENDS = ["Q_Table", "Q_Array", "Q_Sparse", "Q_Paged", "DQN"]
+
+
+'''
+    *** BENCHMARK ***
+    - Every configuration runs in its own process, so that startup time and peak memory are measured from scratch
+    - 'startup_s' is the time to create the environment and its agents (including their Q-tables)
+    - 'steps_per_s' and 'us_per_step' are measured over 'steps' steps after 'warmup' steps; a step moves every agent
+      once (World.step in STAGE_2, one turn of every Q_Learner in STAGE_1), and 'agent_steps_per_s' counts each move
+    - 'peak_rss_mb' is the peak resident memory of the configuration's process
+    - Configurations whose Q-tables (every agent's together) would not fit in 'max_table_mb' are listed as skipped,
+      with the reason
+'''
+
+
+# Every configuration to measure
+def make_configs(max_table_mb):
+    configs = []
+
+    # The STAGE_2 plus map at 1-4 agents for every backend
+    from Make_World import World
+    from State_Space import make_states
+    (width, height) = World.create_map(None, "plus")[:2]
+    for num_agents in range(1, 5):
+        num_states = len(make_states(num_agents, width, height))
+        for backend in STAGE_2_BACKENDS:
+            config = {"stage": 2, "env": "plus", "backend": backend, "num_agents": num_agents}
+            array_mb = num_agents * num_states * 5 * 4 / 2**20  # Every agent holds its own table
+            dict_mb = num_agents * num_states * 5 * 100 / 2**20
+            if backend == "Q_Table" and dict_mb > max_table_mb:
+                config["skipped"] = "%d dicts of %d states would not fit in %d MB" % (num_agents, num_states,
+                                                                                     max_table_mb)
+            elif backend == "Q_Array" and array_mb > max_table_mb:
+                config["skipped"] = "%d arrays (%.0f MB) would not fit in %d MB" % (num_agents, array_mb, max_table_mb)
+            configs.append(config)
+
+    # Every STAGE_1 env, at 1 agent up to the number of agents it was designed for (each agent needs a start cell)
+    for name in STAGE_1_ENVS:
+        native = len(read_stage_1_env(name)["init_state"]) // 2
+        for num_agents in range(1, 5):
+            config = {"stage": 1, "env": name, "backend": "Q_Learner", "num_agents": num_agents}
+            if num_agents > native:
+                config["skipped"] = "%s only has start cells for %d agents" % (name, native)
+            configs.append(config)
+
+    return configs
+
+
+# Read the map of a STAGE_1 env from the map registry, and its agents' exploit period from its script (without
+# running it, as the scripts open a window and train when imported)
+def read_stage_1_env(name):
+    scenario = read_map(name)
+    found = {"width": scenario.width, "height": scenario.height, "walls": scenario.walls,
+             "specials": scenario.specials, "init_state": scenario.init_state}
+    with open(os.path.join(ROOT, "STAGE_1", "envs", name + ".py")) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "Q_Learner":
+            keywords = {k.arg: k.value for k in node.keywords}
+            found["exploit_period"] = ast.literal_eval(keywords["exploit_period"])
+            break
+    return found
+
+
+# Time one configuration (in this process)
+def run_config(config, steps, warmup, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    if config["stage"] == 2:
+        (startup, step) = setup_stage_2(config)
+    else:
+        (startup, step) = setup_stage_1(config)
+
+    for _ in range(warmup):
+        step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    elapsed = time.perf_counter() - start
+
+    result = dict(config, steps=steps, startup_s=startup, steps_per_s=steps / elapsed,
+                  agent_steps_per_s=steps * config["num_agents"] / elapsed, us_per_step=elapsed / steps * 1e6,
+                  peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    return result
+
+
+# Create a headless STAGE_2 World, returning the startup time and its step function
+def setup_stage_2(config):
+    from Make_World import World
+
+    start = time.perf_counter()
+    env = World(map_type=config["env"], coords_type="absolute", num_agents=config["num_agents"],
+                agent_type=config["backend"], load="no", save="no", render_mode="none")
+    return time.perf_counter() - start, env.step
+
+
+# Create a headless STAGE_1 Grid_World and its agents, returning the startup time and a step function that gives
+# every agent one turn in a random order (as the env scripts do)
+def setup_stage_1(config):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from STAGE_1.Make_World import Grid_World
+    from STAGE_1.Agents import Q_Learner
+
+    found = read_stage_1_env(config["env"])
+    n = config["num_agents"]
+    specials = [(a_id, xy, c, r) for (a_id, xy, c, r) in found["specials"] if a_id <= n]
+
+    start = time.perf_counter()
+    env = Grid_World(width=found["width"], height=found["height"], initial_state=found["init_state"][:2 * n],
+                     walls=found["walls"], specials=specials, render_mode="none")
+    agents = [Q_Learner(agent_id=i + 1, discount=0.3, exploit_period=found["exploit_period"], q={}, env=env)
+              for i in range(n)]
+    startup = time.perf_counter() - start
+
+    observation = env.reset()
+    t = 1
+
+    def step():
+        nonlocal observation, t
+        done = False
+        for agent in random.sample(agents, n):
+            observation, done, episode = agent.step(time=t, s=observation)
+        t += 1
+        if done is True:
+            observation = env.reset()
+            t = 1
+
+    return startup, step
+
+
+# Print a results table, with the change against a baseline run where a configuration was measured in both
+def report(results, baseline=None):
+    before = {}
+    if baseline is not None:
+        for b in baseline["results"]:
+            before[(b["env"], b["backend"], b["num_agents"])] = b
+
+    print("%-18s %-10s %6s %12s %10s %10s %10s %8s" % ("env", "backend", "agents", "steps/s", "us/step", "startup_s",
+                                                    "rss_mb", "vs base"))
+    for r in results:
+        if "skipped" in r:
+            print("%-18s %-10s %6d  skipped: %s" % (r["env"], r["backend"], r["num_agents"], r["skipped"]))
+            continue
+        b = before.get((r["env"], r["backend"], r["num_agents"]))
+        change = "%.2fx" % (r["steps_per_s"] / b["steps_per_s"]) if b is not None and "steps_per_s" in b else ""
+        print("%-18s %-10s %6d %12.0f %10.2f %10.3f %10.1f %8s" % (r["env"], r["backend"], r["num_agents"],
+                                                                 r["steps_per_s"], r["us_per_step"], r["startup_s"],
+                                                                 r["peak_rss_mb"], change))
+
+
+'''
+    *** MAIN PROGRAM ***
+    From the STAGE_2 directory:
+        python Benchmark.py --out baseline.json                          # Measure everything
+        python Benchmark.py --only plus --out new.json --baseline baseline.json   # Compare a change on the plus map
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure step throughput across maps, agent counts and backends")
+    parser.add_argument("--steps", type=int, default=20000, help="timed steps per configuration")
+    parser.add_argument("--warmup", type=int, default=1000, help="untimed steps before timing starts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", default=None, help="only run configurations whose env or backend contains this")
+    parser.add_argument("--max_table_mb", type=int, default=1024, help="skip configurations whose in-memory tables "
+                        "(all agents' together) are larger than this")
+    parser.add_argument("--out", default=None, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to compare against")
+    parser.add_argument("--config", default=None, help=argparse.SUPPRESS)  # Used by the child processes
+    args = parser.parse_args()
+
+    # A child process times one configuration and prints its result
+    if args.config is not None:
+        print(json.dumps(run_config(json.loads(args.config), args.steps, args.warmup, args.seed)))
+        sys.exit()
+
+    results = []
+    for config in make_configs(args.max_table_mb):
+        if args.only is not None and args.only not in config["env"] + " " + config["backend"]:
+            continue
+        if "skipped" not in config:
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), "--config", json.dumps(config),
+                                    "--steps", str(args.steps), "--warmup", str(args.warmup), "--seed", str(args.seed)],
+                                   capture_output=True, text=True)
+            if child.returncode != 0:
+                config = dict(config, skipped="failed: " + child.stderr.strip().splitlines()[-1])
+            else:
+                config = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(config)
+        print(len(results), config["env"], config["backend"], config["num_agents"],
+              config.get("skipped", "%.0f steps/s" % config.get("steps_per_s", 0)))
+
+    run = {"machine": {"platform": platform.platform(), "python": platform.python_version(),
+                       "numpy": np.__version__, "cpu_count": os.cpu_count(), "processor": platform.processor()},
+           "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "steps": args.steps, "warmup": args.warmup, "seed": args.seed,
+           "results": results}
+
+    print()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(run, f, indent=2)
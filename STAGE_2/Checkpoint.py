@@ -0,0 +1,350 @@
+__author__ = 'Dylan Klein'
+'''This file reads and writes Q-tables as binary checkpoints that load through a memory map'''
+
+from State_Space import make_states
+import numpy as np
+import argparse
+import base64
+import json
+import os
+import pickle
+import shutil
+import signal
+import sys
+import threading
+import queue
+import time
+import traceback
+
+
+'''
+    *** CHECKPOINT FORMAT ***
+    - 8 bytes: the magic string MAGIC
+    - 4 bytes: the length of the header (unsigned, little-endian)
+    - the header: a JSON object describing the table
+        {"version", "map_type", "num_agents", "coords_type", "shared", "actions", "shape", "dtype", "offset"}
+      and, for a table saved from a Page_Store, "pages": {"page_rows", "initial", "written"}, where "written" is a
+      bitmap (np.packbits, then base64) of the pages of 'page_rows' rows that hold data
+    - zero padding up to 'offset', a multiple of ALIGN bytes
+    - the Q-table: a flat little-endian float32 array of shape (num_states, num_actions), stored row by row (the
+      pages not written are holes in a sparse file, and read as 'initial')
+    The table is never deserialised: np.memmap maps the file straight into memory, so a load costs nothing until
+    rows are touched, and processes that open the same checkpoint share its pages through the page cache.
+'''
+
+MAGIC = b"MARLQCK\x01"
+VERSION = 2
+READABLE = [1, 2]  # Version 1 checkpoints have no "pages" field
+ALIGN = 64
+EXTENSION = ".qck"
+
+# The header fields that must agree between a checkpoint and the environment that loads it
+MATCHED = ["map_type", "num_agents", "coords_type", "shared", "actions"]
+
+
+# Describe the Q-table of an environment
+def make_header(map_type, num_agents, coords_type, shared, actions):
+    return {"map_type": map_type, "num_agents": num_agents, "coords_type": coords_type, "shared": shared,
+            "actions": list(actions)}
+
+
+# Encode everything in front of the table of a checkpoint with the given shape, returning the bytes and the full
+# header (whose "offset" is where the table starts)
+def encode_header(header, shape):
+    header = dict(header, version=VERSION, shape=list(shape), dtype="<f4")
+
+    # The data offset depends on the header's own length, so grow it until it is stable
+    header["offset"] = 0
+    while True:
+        text = json.dumps(header, sort_keys=True).encode()
+        offset = -(-(len(MAGIC) + 4 + len(text)) // ALIGN) * ALIGN
+        if header["offset"] == offset:
+            break
+        header["offset"] = offset
+
+    data = MAGIC + len(text).to_bytes(4, "little") + text
+    return data + b"\x00" * (offset - len(data)), header
+
+
+# Write a Q-table to a checkpoint file (written to a temporary file first, so a crash never leaves half a checkpoint
+# and a table that is memory-mapped from 'path' can be saved back over it)
+def write_checkpoint(path, table, header):
+    table = np.ascontiguousarray(table, dtype="<f4")
+    (data, header) = encode_header(header, table.shape)
+
+    temp = path + ".tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.write(table.tobytes())
+    os.replace(temp, path)
+
+
+# Read the header of a checkpoint file
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a Q-table checkpoint" % path)
+        length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(length).decode())
+    if header["version"] not in READABLE:
+        raise ValueError("%s has checkpoint version %s, expected one of %s" % (path, header["version"], READABLE))
+    return header
+
+
+# Describe which pages of a table hold data, for the "pages" field of a header
+def encode_pages(written, page_rows, initial):
+    return {"page_rows": page_rows, "initial": initial,
+            "written": base64.b64encode(np.packbits(written).tobytes()).decode()}
+
+
+# Which pages of a table hold data, from the "pages" field of a header
+def decode_pages(header):
+    pages = header["pages"]
+    num_pages = -(-header["shape"][0] // pages["page_rows"])
+    bits = np.frombuffer(base64.b64decode(pages["written"]), dtype=np.uint8)
+    return np.unpackbits(bits, count=num_pages).astype(bool)
+
+
+# Map the Q-table of a checkpoint file into memory
+#   mode="r": read-only, "c": copy-on-write (pages written by this process become private, the rest stay shared),
+#   "r+": writes go back to the file
+def read_checkpoint(path, expected=None, mode="c"):
+    header = read_header(path)
+
+    # Refuse a table that was trained on a different environment
+    if expected is not None:
+        for field in MATCHED:
+            if header[field] != expected[field]:
+                raise ValueError("%s was saved with %s=%r, but the environment has %s=%r"
+                                 % (path, field, header[field], field, expected[field]))
+
+    table = np.memmap(path, dtype=header["dtype"], mode=mode, offset=header["offset"], shape=tuple(header["shape"]))
+
+    # Fill in the pages a Page_Store never wrote (in memory only, as the map is copy-on-write or copied)
+    if "pages" in header:
+        if mode == "r":
+            table = np.array(table)
+        page_rows = header["pages"]["page_rows"]
+        for p in np.flatnonzero(~decode_pages(header)):
+            table[p * page_rows:(p + 1) * page_rows] = header["pages"]["initial"]
+    return header, table
+
+
+# Convert a pickled Q-table (a dict of dicts keyed by state tuples or state indices) into a checkpoint file
+def import_pickle(pkl_path, path, header):
+    from Agents import Q_Array  # Imported here, as Agents imports this module
+
+    with open(pkl_path, 'rb') as f:
+        q = pickle.load(f)
+    (width, height) = map_size(header["map_type"])
+    states = make_states(header["num_agents"], width, height)
+    write_checkpoint(path, Q_Array.from_dict(q, states, header["actions"]), header)
+
+
+# The width and height of a map
+def map_size(map_type):
+    from Make_World import World  # Imported here, as Make_World imports this module through Agents
+
+    (width, height, walls, goals, starts, map_mode) = World.create_map(None, map_type)
+    return width, height
+
+
+class Checkpointer:
+    """
+        Saves a World's Q-tables and training state every 'every_episodes' episodes and/or every 'every_seconds' seconds while it trains.
+            - method="fork" (the default where os.fork exists): a forked process writes the checkpoint from its
+              copy-on-write view of the parent's memory, so the training thread never copies a table, and only the
+              memory pages training changes while the checkpoint is written are ever duplicated
+            - method="thread": the training thread copies the tables (a consistent snapshot between two steps) and a
+              background thread writes the copies, so training carries on while the files are written
+            - A table kept on disk ("Q_Paged") only has its dirty pages flushed on the training thread in either
+              case; its file is copied while training carries on (see Page_Store.begin_copy)
+            - Each checkpoint is a directory named after the time step, e.g. Saved_Files/Checkpoints/step_000001000,
+              holding the same files as Saved_Files (copy them back into Saved_Files to train or test from them)
+            - A checkpoint is written into a temporary directory and renamed into place, so a crash never leaves a
+              partial checkpoint behind, and only the newest 'keep' checkpoints are kept
+            - A checkpoint that falls due while the previous one is still being written is taken once that one is done
+            - A Ctrl-C stops training but not the forked process, which finishes the checkpoint it is writing
+
+            checkpointer = Checkpointer(env, every_seconds=300)
+            while training:
+                env.step()
+                checkpointer.update()
+            checkpointer.close()
+    """
+
+    def __init__(self, env, every_episodes=None, every_seconds=None, keep=3, directory='Saved_Files/Checkpoints',
+                 method=None):
+
+        self.env = env
+        self.every_episodes = every_episodes
+        self.every_seconds = every_seconds
+        if keep < 1:
+            raise ValueError("keep must be at least 1, got %r" % keep)
+        self.keep = keep
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        Checkpointer.clean(self)
+
+        # When the last checkpoint was taken
+        self.last_episode = env.episode_count
+        self.last_time = time.monotonic()
+
+        self.method = method or ("fork" if hasattr(os, "fork") else "thread")
+        self.writing = False  # True from taking a snapshot until it has been written
+        self.error = None  # An exception raised while writing, re-raised on the training thread
+        self.child = None  # The forked process writing the current checkpoint, and the snapshots it was given
+        self.written = 0  # To count the checkpoints written
+
+        # The writer thread takes one snapshot at a time from the queue
+        self.snapshots = queue.Queue()
+        self.writer = None
+        if self.method == "thread":
+            self.writer = threading.Thread(target=Checkpointer.write_loop, args=(self,), daemon=True)
+            self.writer.start()
+
+    # Take a checkpoint if one is due (call once per step; this is cheap when nothing is due)
+    def update(self):
+        if self.child is not None:
+            Checkpointer.poll(self)
+        if self.error is not None:
+            raise self.error
+        if self.writing:
+            return
+        due = (self.every_episodes is not None and self.env.episode_count - self.last_episode >= self.every_episodes) or \
+              (self.every_seconds is not None and time.monotonic() - self.last_time >= self.every_seconds)
+        if due:
+            Checkpointer.save(self)
+
+    # Snapshot the tables and hand them to the writer thread, or fork a process to write them
+    def save(self):
+        agents = self.env.agent_list[:1] if self.env.shared == "yes" else self.env.agent_list
+        name = "step_%09d" % self.env.time_step
+        self.last_episode = self.env.episode_count
+        self.last_time = time.monotonic()
+        self.writing = True
+        if self.method == "fork":
+            Checkpointer.fork(self, name, agents)
+        else:
+            tables = [(agent, agent.snapshot()) for agent in agents]
+            self.snapshots.put((name, tables, self.env.training_state()))
+
+    # Write a checkpoint from a forked process, which sees the tables as they are now for as long as it runs
+    def fork(self, name, agents):
+        tables = [(agent, None if agent.in_memory else agent.snapshot()) for agent in agents]
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # A Ctrl-C is sent to the whole process group
+            status = 0
+            try:
+                Checkpointer.write(self, name, tables, self.env.training_state())
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)  # Skips the parent's exit handlers and finalizers (which delete its working files)
+        self.child = (pid, tables)
+
+    # Check whether the forked process has finished its checkpoint (wait=True to wait until it has)
+    def poll(self, wait=False):
+        (pid, tables) = self.child
+        (done, status) = os.waitpid(pid, 0 if wait else os.WNOHANG)
+        if done == 0:
+            return
+        self.child = None
+        for (agent, table) in tables:
+            if table is not None:
+                agent.release(table)
+        if os.waitstatus_to_exitcode(status) != 0:
+            self.error = RuntimeError("The process writing a checkpoint failed (exit status %d)"
+                                      % os.waitstatus_to_exitcode(status))
+        else:
+            self.written += 1
+        self.writing = False
+
+    # Write snapshots as they arrive (on the writer thread)
+    def write_loop(self):
+        while True:
+            item = self.snapshots.get()
+            if item is None:
+                break
+            try:
+                Checkpointer.write(self, *item)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+            for (agent, table) in item[1]:
+                agent.release(table)
+            self.writing = False
+
+    # Write one checkpoint directory atomically, then delete the oldest checkpoints
+    def write(self, name, tables, state):
+        path = os.path.join(self.directory, name)
+        temp = path + ".tmp"
+        Checkpointer.clean(self)
+        os.makedirs(temp)
+        for (agent, table) in tables:
+            agent.save(temp, table)
+        self.env.save_training_state(temp, state)
+        shutil.rmtree(path, ignore_errors=True)  # Only left over if training restarted from an earlier time step
+        os.rename(temp, path)
+        for old in Checkpointer.list(self)[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    # Delete the temporary directories of checkpoints that were never finished (only one is written at a time)
+    def clean(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("step_") and name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    # The names of the complete checkpoints, oldest first
+    def list(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith("step_") and "." not in name)
+
+    # Take a final checkpoint (if 'final' is True), wait for every checkpoint to be written and stop the writer thread
+    #   interrupted=True (or a KeyboardInterrupt being raised) reports a failed checkpoint instead of raising it, so
+    #   the interrupt is not hidden
+    def close(self, final=True, interrupted=False):
+        if final and self.error is None:
+            Checkpointer.wait(self)
+            if self.error is None:
+                Checkpointer.save(self)
+        Checkpointer.wait(self)
+        if self.writer is not None:
+            self.snapshots.put(None)
+            self.writer.join()
+        if self.error is not None:
+            if not final and (interrupted or isinstance(sys.exc_info()[1], KeyboardInterrupt)):
+                print("A checkpoint was not written:", repr(self.error), file=sys.stderr)
+                return
+            raise self.error
+
+    # Wait until the checkpoint being written (if any) has been written
+    def wait(self):
+        if self.child is not None:
+            Checkpointer.poll(self, wait=True)
+        while self.writing and self.child is None:
+            time.sleep(0.001)
+
+
+'''
+    *** IMPORTER ***
+    Convert an old pickled Q-table, e.g. from the STAGE_2 directory:
+        python Checkpoint.py Saved_Files/agentA_saved.pkl --map_type plus --coords_type absolute --num_agents 1
+    writes Saved_Files/agentA_saved.qck next to it.
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a pickled Q-table into a checkpoint file")
+    parser.add_argument("pkl_path")
+    parser.add_argument("--out", default=None, help="checkpoint path (default: the .pkl path with a .qck extension)")
+    parser.add_argument("--map_type", default="plus")
+    parser.add_argument("--coords_type", default="absolute", choices=["absolute", "relative"])
+    parser.add_argument("--num_agents", type=int, default=1)
+    parser.add_argument("--shared", default="no", choices=["yes", "no"])
+    args = parser.parse_args()
+
+    out = args.out or os.path.splitext(args.pkl_path)[0] + EXTENSION
+    actions = ["up", "down", "left", "right", "none"]  # The action space of World
+    import_pickle(args.pkl_path, out, make_header(args.map_type, args.num_agents, args.coords_type, args.shared, actions))
+    print("Wrote", out, read_header(out))
@@ -3,175 +3,220 @@ __author__ = 'Dylan Klein'
 
 from State_Space import make_states
 from Agents import *
-from tkinter import *  # For rendering
+from Render import Tk_Renderer, Image_Renderer
+from Map_Registry import read_map
+from Planner import load_plan
+from Checkpoint import make_header
+from time import perf_counter
 from random import randint, choice
 import numpy as np
+import random
+import pickle
+import os
 
 # import matplotlib.pyplot as plt
 
 
+# The agent attributes saved in the training state (those an agent lacks are skipped)
+RESUMED = ["epsilon", "alpha", "cell", "goal", "intent", "action", "reward", "state", "state2", "evictions"]
+
+# The default learning and reward settings, any of which a World's 'hyperparameters' can override (see Sweep.py)
+HYPERPARAMETERS = {"discount": 0.3, "epsilon": 0.1, "epsilon_decay": 0.9, "alpha_power": 0.1, "visit_power": 0.8,
+                   "walk_punishment": 0.04, "goal_reward": 5, "crash_punishment": 10}
+
+
+# The default hyperparameters, overridden by any given in 'hyperparameters' (which must all be known)
+def read_hyperparameters(hyperparameters):
+    unknown = set(hyperparameters or {}) - set(HYPERPARAMETERS)
+    if unknown:
+        raise ValueError("Unknown hyperparameters %s (the hyperparameters are %s)"
+                         % (", ".join(sorted(unknown)), ", ".join(HYPERPARAMETERS)))
+    return dict(HYPERPARAMETERS, **(hyperparameters or {}))
+
+
 class World:
 
-    def __init__(self, map_type, coords_type, num_agents, agent_type, load, save):
+    def __init__(self, map_type, coords_type, num_agents, agent_type, load, save, max_rows=None, shared="no",
+                 render_mode="tk", memory_budget=64 * 2**20, replay_size=0, replay_batch=0, act_mode="sequential",
+                 hyperparameters=None, alpha_schedule="time", warm_start="no"):
 
         # File saving
         self.load = load  # If load has value "yes", read each agent's Q-table from a file for initialisation
         self.save = save  # If save has value "yes", write each agent's Q-table to a file after training is completed
+        self.max_rows = max_rows  # The most Q-table rows a "Q_Sparse" agent keeps before evicting cold ones
+        self.shared = shared  # If shared has value "yes", all agents read and update a single Q-table
+        self.memory_budget = memory_budget  # The bytes of Q-table pages a "Q_Paged" agent keeps in memory
+        self.replay_size = replay_size  # The transitions a "Q_Array" agent keeps for replay (0 for no replay)
+        self.replay_batch = replay_batch  # The replayed updates a "Q_Array" agent makes per step
+        self.alpha_schedule = alpha_schedule  # "time" or "visits": what a "Q_Array" agent's learning rates decay with
+        if self.alpha_schedule == "visits" and agent_type != "Q_Array":
+            raise ValueError('alpha_schedule="visits" needs "Q_Array" agents')
+
+        # Learning and reward settings (the defaults, overridden by any given in 'hyperparameters')
+        self.hyperparameters = read_hyperparameters(hyperparameters)
 
         # Environment variables
         self.actions = ["up", "down", "left", "right", "none"]
         self.wall_punishment = 1
-        self.walk_punishment = 0.04
-        self.goal_reward = 5  # To give if all agents collaborate
+        self.walk_punishment = self.hyperparameters["walk_punishment"]
+        self.goal_reward = self.hyperparameters["goal_reward"]  # To give if all agents collaborate
         self.goal_count = 0  # To track how many goals have been reached (in episodic mode only)
-        self.crash_punishment = 10  # To punish if any agents crash
+        self.crash_punishment = self.hyperparameters["crash_punishment"]  # To punish if any agents crash
+        self.map_type = map_type
         self.width, self.height, self.walls, self.goals, self.starts, self.map_mode = World.create_map(self, map_type)
         self.coords_type = coords_type  # To toggle between relative and absolute coordinates
-
-        # Create a board to render to
-        self.master = Tk()
-        self.L = 100  # side length of a cell in pixels
-        self.board = Canvas(self.master, width=self.width * self.L, height=self.height * self.L)
-        self.board.grid(row=0, column=0)
-
-        # Render the static components of the environment
-        for i in range(self.width):
-            for j in range(self.height):
-                self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill="white", width=1)
-        for ((i, j), g_id) in self.goals:
-            self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill="green", width=1)
-        for (i, j) in self.walls:
-            self.board.create_rectangle(i * self.L, j * self.L, (i + 1) * self.L, (j + 1) * self.L, fill="black", width=1)
+        self.transitions = read_map(map_type).transitions(self.actions)  # The map compiled for moving (once per map)
+        self.next_cell = self.transitions.next_cell_list
+        self.blocked = self.transitions.blocked_list
+        self.action_index = self.transitions.action_index
 
         # Multi-agent variables
         self.num_agents = num_agents
-        self.states = make_states(self.num_agents, self.width, self.height)  # Create the entire state space
+        self.states = make_states(self.num_agents, self.width, self.height)  # Create the lazy state space (no states are enumerated)
         self.num_states = len(self.states)
         self.agent_list = World.make_agents(self, agent_type)  # To create instances of agents
         self.collisions = 0  # To count how many collisions have occurred in each episode
 
         # RL variables
         self.global_state = [0] * (self.num_agents * 2)  # Create a global state array
+        self.occupancy = [0] * self.transitions.num_cells  # To count how many agents stand in each cell
+        self.occupancy[0] = self.num_agents  # Agents start at (0, 0) until they are spawned
+        self.cells = [0] * self.num_agents  # Every agent's cell, indexed by agent ID
+        World.make_encoder(self)
         self.rewards = 0
         self.restart = False
         self.episode_info = ""
         self.episode_count = 1  # Integer to store how many episodes have occurred
         self.time_step = 0  # To count each step
+        self.profiler = None  # Set to a Step_Profiler to time the phases of every step (see Profiler.py)
+        self.cumulative_rewards = [0] * self.num_agents  # Every agent's total reward since training started
+        self.agent_collisions = [0] * self.num_agents  # Every agent's total collisions since training started
+        self.agent_goals = [0] * self.num_agents  # Every agent's total goals since training started
+
+        # Start the agents' tables from the Q-values planned from the map (see Planner.py), unless they were loaded
+        self.warm_start = warm_start
+        if self.warm_start == "yes" and self.load != "yes":
+            if agent_type == "DQN":
+                raise ValueError('warm_start="yes" needs agents with Q-tables')
+            for (agent, (states, values)) in zip(self.agent_list, load_plan(self)[0]):
+                agent.set_rows(states, values)  # With a shared table, there is only the first agent's table
+
+        # "sequential": each agent chooses its action on its turn, seeing the moves of the agents before it
+        # "batched": every agent chooses its action at the start of the step, before any agent moves
+        self.act_mode = act_mode
+        if self.act_mode == "batched":
+            World.make_batch_actor(self, agent_type)
 
         # Create an initial random state
         World.reset_all_agents(self)
 
-        # Create objects for rendering agents
+        # Carry on from the saved training state, if there is one
+        if self.load == "yes" and os.path.exists('Saved_Files/world_saved.pkl'):
+            World.load_training_state(self)
+
+        # Create the renderer ("tk" draws to a window, "image" draws NumPy RGB frames, "none" draws nothing)
+        self.render_mode = render_mode
+        self.L = 100  # side length of a cell in pixels
         self.colours = ["orange", "blue", "pink", "purple", "yellow"]
         self.names = ["A", "B", "C", "D", "E"]
         self.triangle_size = 0.2
-        for agent in self.agent_list:
-            (x, y) = agent.position
-            agent.object = self.board.create_rectangle(x * self.L + self.L * 2 / 10,
-                                                       y * self.L + self.L * 2 / 10,
-                                                       x * self.L + self.L * 8 / 10,
-                                                       y * self.L + self.L * 8 / 10,
-                                                       fill=self.colours[agent.agent_id],
-                                                       width=1, tag=self.names[agent.agent_id])
-
-            agent.arrow = self.board.create_polygon(0, 0, fill="black", width=1)
+        if self.render_mode == "tk":
+            self.renderer = Tk_Renderer(self)
+        elif self.render_mode == "image":
+            self.renderer = Image_Renderer(self)
+        else:
+            self.renderer = None
 
-    # Start rendering the 'master' object
+    # Start rendering the 'master' object (only a Tk window has one)
     def start_game(self):
-        self.master.mainloop()
+        if self.render_mode == "tk":
+            self.renderer.start()
 
     def reset_all_agents(self):
         for agent in self.agent_list:
             World.reset(self, agent)
 
     def reset(self, agent):
+        if self.profiler is not None:
+            self.profiler.resets[agent.agent_id] += 1
         World.spawn(self, agent)
         World.new_goal(self, agent)
         World.update_intent(self, agent)
-        World.update_global_state(self)  # Update the global state
 
+    # Draw the agents (an "image" renderer returns the frame as a NumPy RGB array)
     def render(self):
-        for agent in self.agent_list:
-            (x, y) = agent.position
-            self.board.coords(agent.object,
-                              x * self.L + self.L * 2 / 10,
-                              y * self.L + self.L * 2 / 10,
-                              x * self.L + self.L * 8 / 10,
-                              y * self.L + self.L * 8 / 10)
-            World.update_arrow(self, agent)
+        if self.renderer is not None:
+            return self.renderer.render(self.agent_list)
 
     def update_arrow(self, agent):
-        (x, y) = agent.position
-        nudge = self.triangle_size / 2
-        if agent.intent == "S":
-            (self.board.coords(agent.arrow,
-                               (x + 0.5 - self.triangle_size) * self.L, (y + 0.5 - nudge) * self.L,
-                               (x + 0.5 + self.triangle_size) * self.L, (y + 0.5 - nudge) * self.L,
-                               (x + 0.5) * self.L, (y + 0.5 + self.triangle_size - nudge) * self.L))
-        elif agent.intent == "W":
-            (self.board.coords(agent.arrow,
-                               (x + 0.5 + nudge) * self.L, (y + 0.5 - self.triangle_size) * self.L,
-                               (x + 0.5 + nudge) * self.L, (y + 0.5 + self.triangle_size) * self.L,
-                               (x + 0.5 + nudge - self.triangle_size) * self.L, (y + 0.5) * self.L))
-        elif agent.intent == "N":
-            (self.board.coords(agent.arrow,
-                               (x + 0.5 - self.triangle_size) * self.L, (y + 0.5 + nudge) * self.L,
-                               (x + 0.5 + self.triangle_size) * self.L, (y + 0.5 + nudge) * self.L,
-                               (x + 0.5) * self.L, (y + 0.5 - self.triangle_size + nudge) * self.L))
-        elif agent.intent == "E":
-            (self.board.coords(agent.arrow,
-                               (x + 0.5 - nudge) * self.L, (y + 0.5 - self.triangle_size) * self.L,
-                               (x + 0.5 - nudge) * self.L, (y + 0.5 + self.triangle_size) * self.L,
-                               (x + 0.5 - nudge + self.triangle_size) * self.L, (y + 0.5) * self.L))
+        if self.renderer is not None:
+            self.renderer.update_arrow(agent)
 
     def step(self):
+        prof = self.profiler  # None unless the step is being profiled (every check below is then a single test)
+        if prof is not None:
+            start = perf_counter()
+
         self.time_step += 1
         self.rewards = [0] * self.num_agents  # Reset the rewards list to zero
         self.restart = False
         copy_agent_list = list(self.agent_list)
 
+        # Choose every agent's action at once, before any agent moves
+        batched = self.act_mode == "batched"
+        if batched:
+            if prof is not None:
+                t = perf_counter()
+            World.act_all(self)
+            if prof is not None:
+                prof.lap(1, t)
+
         for _ in range(self.num_agents):
             agent = choice(copy_agent_list)  # Choose a random agent from the list
             copy_agent_list.remove(agent)  # Remove agent from the list so it can't be selected again in the same step
 
             # Initialise the agent's reward for the step
             agent.reward = 0
+            if prof is not None:
+                t = perf_counter()
 
-            # Reformat state from global to local (per agent)
-            agent.state = World.reformat_state(self, agent, self.coords_type)
-
-            # Agent to choose an action for the step
-            agent.act()
-
-            # Calculate incremental changes in x,y coordinates
-            if agent.action == self.actions[0]:
-                (dx, dy) = (0, -1)  # UP
-            elif agent.action == self.actions[1]:
-                (dx, dy) = (0, 1)  # DOWN
-            elif agent.action == self.actions[2]:
-                (dx, dy) = (-1, 0)  # LEFT
-            elif agent.action == self.actions[3]:
-                (dx, dy) = (1, 0)  # RIGHT
-            else:
-                (dx, dy) = (0, 0)  # NONE
+            if not batched:
+
+                # Encode the agent's local state as an index of the state space
+                agent.state = World.encode_state(self, agent)
+                if prof is not None:
+                    t = prof.lap(0, t)
 
-            # Calculate the new proposed position
-            new_x = agent.position[0] + dx
-            new_y = agent.position[1] + dy
+                # Agent to choose an action for the step
+                agent.act()
+                if prof is not None:
+                    t = prof.lap(1, t)
+
+            # Look up the move in the compiled transition tables
+            a = self.action_index[agent.action]
 
             # Try move the caller agent to a new cell if possible
-            if (new_x >= 0) and (new_x < self.width) and (new_y >= 0) and (new_y < self.height) and not ((new_x, new_y) in self.walls):
-                agent.position = (new_x, new_y)
+            if not self.blocked[agent.cell][a]:
+                World.place(self, agent, self.next_cell[agent.cell][a])
                 agent.reward = -self.walk_punishment
-
-                # Update the global state
-                World.update_global_state(self)
+                if prof is not None:
+                    t = prof.lap(2, t)
 
                 # Check for a collision of agents
-                if World.has_collided(self, agent) is True:
+                collided = World.has_collided(self, agent)
+                if prof is not None:
+                    t = prof.lap(3, t)
+                if collided is True:
                     agent.reward = -self.crash_punishment
+                    self.agent_collisions[agent.agent_id] += 1
+                    if prof is not None:
+                        prof.collisions[agent.agent_id] += 1
                     if self.map_mode == "episodic":
                         World.reset_all_agents(self)
+                        if batched:
+                            # The agents still to move learn from where they now are
+                            for other in copy_agent_list:
+                                other.state = World.encode_state(self, other)
                     elif self.map_mode == "non-episodic":
                         World.reset(self, agent)
                     self.collisions += 1
@@ -182,6 +227,9 @@ class World:
                     for ((x, y), g_id) in self.goals:
                         if agent.position == (x, y) and agent.goal == g_id:
                             agent.reward = self.goal_reward
+                            self.agent_goals[agent.agent_id] += 1
+                            if prof is not None:
+                                prof.goals[agent.agent_id] += 1
                             if self.map_mode == "episodic":
                                 World.reset(self, agent)
                             elif self.map_mode == "non-episodic":
@@ -189,23 +237,39 @@ class World:
                                 World.update_intent(self, agent)
                             self.episode_count += 1
                             self.restart = True
+                    if prof is not None:
+                        t = prof.lap(4, t)
 
             # If the cell is not valid, it must belong to a wall our reside outside the world boundaries
             else:
                 agent.reward = -self.crash_punishment
+                if prof is not None:
+                    t = prof.lap(2, t)
 
-            # Reformat state from global to local (per agent)
-            agent.state2 = World.reformat_state(self, agent, self.coords_type)
+            # Encode the agent's new local state as an index of the state space
+            agent.state2 = World.encode_state(self, agent)
+            if prof is not None:
+                t = prof.lap(0, t)
 
             # Agent to learn from the new state and reward pair
             agent.learn(self.time_step, self.restart)
+            if prof is not None:
+                prof.lap(5, t)
 
             # Output a list of rewards for the step
             self.rewards[agent.agent_id] = agent.reward
+            self.cumulative_rewards[agent.agent_id] += agent.reward
 
-        return self.global_state, self.rewards, self.restart, self.episode_info
+        if batched and self.restart:
+            World.read_epsilons(self)  # Epsilons only decay when an episode restarts
 
-    # Create the geometry of the desired map type
+        if prof is not None:
+            prof.end_step(start, self.episode_count)
+
+        return list(self.global_state), self.rewards, self.restart, self.episode_info
+
+    # Look up the geometry of the desired map type in the map registry (the maps are defined in the Maps directory,
+    # see Map_Registry.py)
     def create_map(self, map_type):
         """
             *** DEFINING THE WALL CELLS OF THE WORLD ***
@@ -228,108 +292,144 @@ class World:
                         y = y_coordinate of cell
         """
 
-        if map_type == "plus":
+        m = read_map(map_type)
+        return m.width, m.height, m.walls, m.goals, m.starts, m.map_mode
 
-            width = 5
-            height = 5
+    # Create instances of agents and save in a global agent list
+    def make_agents(self, agent_type):
 
-            walls = [(0, 0), (1, 0),     (3, 0), (4, 0),
-                     (0, 1), (1, 1),     (3, 1), (4, 1),
+        agent_list = []
+        (discount, epsilon_decay) = (self.hyperparameters["discount"], self.hyperparameters["epsilon_decay"])
+        # The description of the environment saved with checkpoints
+        header = make_header(self.map_type, self.num_agents, self.coords_type, self.shared, self.actions)
 
-                     (0, 3), (1, 3),     (3, 3), (4, 3),
-                     (0, 4), (1, 4),     (3, 4), (4, 4)]
+        if agent_type == "Q_Table":
 
-            goals = [((4, 2), (0, 0, 0, 1)),
-                     ((2, 0), (0, 0, 1, 0)),
-                     ((0, 2), (0, 1, 0, 0)),
-                     ((2, 4), (1, 0, 0, 0))]
+            if self.load == "yes":
+                Q = "load"
 
-            starts = [(2, 4), (0, 2), (2, 0), (4, 2)]
+            else:
+                # Create a new Q-table keyed by state index, with all Q-values initialised to 0.1
+                Q = {}
+                for state in range(self.num_states):
+                    temp = {}
+                    for action in self.actions:
+                        temp[action] = 0.1
+                    Q[state] = temp  # Initialise Q table
 
-            map_mode = "non-episodic"
+            for i in range(self.num_agents):
+                agent = Q_Table(agent_id=i, discount=discount, epsilon_decay=epsilon_decay, actions=self.actions, q=Q,
+                                shared=self.shared == "yes", states=self.states)
+                agent_list.append(agent)
+                if self.shared == "yes":
+                    Q = agent.Q  # Later agents use the first agent's table
 
-        else:
-            width = 0
-            height = 0
-            walls = []
-            goals = []
-            starts = []
-            map_mode = ""
+        elif agent_type == "Q_Array":
 
-        return width, height, walls, goals, starts, map_mode
+            if self.load == "yes":
+                Q = "load"
 
-    # Create instances of agents and save in a global agent list
-    def make_agents(self, agent_type):
+            else:
+                # Create a new dense Q-table, with all Q-values initialised to 0.1
+                Q = np.full((self.num_states, len(self.actions)), 0.1, dtype=np.float32)
 
-        agent_list = []
+            for i in range(self.num_agents):
+                agent = Q_Array(agent_id=i, discount=discount, epsilon_decay=epsilon_decay, actions=self.actions, q=Q,
+                                states=self.states, shared=self.shared == "yes", header=header,
+                                replay_size=self.replay_size, replay_batch=self.replay_batch,
+                                alpha_schedule=self.alpha_schedule, visit_power=self.hyperparameters["visit_power"])
+                if self.shared == "yes" and agent_list:
+                    agent.visits = agent_list[0].visits  # Later agents count visits in the first agent's counts
+                agent_list.append(agent)
+                if self.shared == "yes":
+                    Q = agent.Q  # Later agents use the first agent's table
 
-        if agent_type is "Q_Table":
+        elif agent_type == "Q_Sparse":
 
-            if self.load is "yes":
+            if self.load == "yes":
                 Q = "load"
 
             else:
-                # Create a new Q-table, with all Q-values initialised to 0.1
+                # Rows are created on first visit, so the Q-table starts empty
                 Q = {}
-                for state in self.states:
-                    temp = {}
-                    for action in self.actions:
-                        temp[action] = 0.1
-                    Q[state] = temp  # Initialise Q table
 
             for i in range(self.num_agents):
-                agent = Q_Table(agent_id=i, discount=0.3, epsilon_decay=0.9, actions=self.actions, q=Q)
+                agent = Q_Sparse(agent_id=i, discount=discount, epsilon_decay=epsilon_decay, actions=self.actions, q=Q,
+                                 states=self.states, max_rows=self.max_rows, shared=self.shared == "yes")
                 agent_list.append(agent)
+                if self.shared == "yes":
+                    Q = agent.Q  # Later agents use the first agent's table
 
-        elif agent_type is "DQN":
+        elif agent_type == "Q_Paged":
 
-            if self.load is "yes":
+            if self.load == "yes":
                 Q = "load"
 
             else:
+                # Pages are filled with 0.1 on first use, so the Q-table starts empty
                 Q = "new"
 
             for i in range(self.num_agents):
-                agent = DQN(agent_id=i, discount=0.3, epsilon_decay=0.9, actions=self.actions, num_states=self.num_states, q=Q)
+                agent = Q_Paged(agent_id=i, discount=discount, epsilon_decay=epsilon_decay, actions=self.actions, q=Q,
+                                states=self.states, shared=self.shared == "yes", header=header,
+                                memory_budget=self.memory_budget)
                 agent_list.append(agent)
+                if self.shared == "yes":
+                    Q = agent.Q  # Later agents use the first agent's store
+
+        elif agent_type == "DQN":
+
+            if self.load == "yes":
+                Q = "load"
+
+            else:
+                Q = "new"
+
+            for i in range(self.num_agents):
+                agent = DQN(agent_id=i, discount=discount, epsilon_decay=epsilon_decay, actions=self.actions,
+                            states=self.states, q=Q, shared=self.shared == "yes")
+                agent_list.append(agent)
+                if self.shared == "yes":
+                    Q = agent.Q  # Later agents train the first agent's network
 
         elif False:  # Insert future learning methods here
             pass
 
+        # The exploration and learning rate schedule the agents start from
+        for agent in agent_list:
+            agent.epsilon = self.hyperparameters["epsilon"]
+            agent.alpha_power = self.hyperparameters["alpha_power"]
+
         return agent_list
 
     # Spawn an agent in a vacant starting cell
     def spawn(self, agent):
-        vacant_array = [1] * len(self.starts)
-        for start in range(len(self.starts)):
-            for Agent in self.agent_list:
-                if Agent.position == self.starts[start]:
-                    vacant_array[start] = 0
-            if vacant_array[start] == 1:
-                agent.position = self.starts[start]
+        for (x, y) in self.starts:
+            cell = self.transitions.cell(x, y)
+            if self.occupancy[cell] == 0:
+                World.place(self, agent, cell)
                 break
 
-    # Create a global state by appending all agents states
+    # Move an agent to a cell, updating the occupancy grid and the agent's entries in the global state
+    def place(self, agent, cell):
+        self.occupancy[agent.cell] -= 1
+        self.occupancy[cell] += 1
+        agent.cell = cell
+        self.cells[agent.agent_id] = cell
+        agent.position = self.transitions.cell_xy_list[cell]
+        (self.global_state[2*agent.agent_id], self.global_state[2*agent.agent_id+1]) = agent.position
+
+    # Create a global state by appending all agents states (place keeps it up to date, so this is only needed if
+    # agents' positions are changed by hand)
     def update_global_state(self):
         self.global_state = []
         for Agent in self.agent_list:
             self.global_state.append(Agent.position[0])
             self.global_state.append(Agent.position[1])
 
-    # Check to see if any agents have the same coordinates, indicating that a collision has occurred
+    # Check to see if any other agent stands in the agent's cell, indicating that a collision has occurred
     def has_collided(self, agent):
-
-        # Remove the caller agent's own coordinates from the state list in order to compare with other agents
-        other_agents = tuple(self.global_state)
-        other_agents = list(other_agents)
-        del other_agents[2*agent.agent_id]
-        del other_agents[2*agent.agent_id]
-
-        # Search the modified state list for other agents who occupy the same space
-        for i in range(self.num_agents - 1):
-            if (other_agents[2*i], other_agents[2*i+1]) == agent.position:
-                return True
-        return False
+        return self.occupancy[agent.cell] > 1
 
     # Once a goal is reached, pick a new goal for the agent
     def new_goal(self, agent):
@@ -348,25 +448,91 @@ class World:
 
         agent.goal = random_new_goal
 
-    # Reformat the global state for an individual agent
+    # Check that the agents can choose their actions in one call: only a shared network batches the choice (a gather
+    # and argmax over a block of "Q_Array" tables costs several times more than each agent's own act at these agent
+    # counts, and the block would copy every table)
+    def make_batch_actor(self, agent_type):
+        if agent_type != "DQN" or self.shared != "yes":
+            raise ValueError('act_mode="batched" needs "DQN" agents with shared="yes"')
+        self.epsilons = np.zeros(self.num_agents)  # Every agent's epsilon, refreshed whenever epsilons change
+        World.read_epsilons(self)
+
+    # Copy the agents' epsilons into the preallocated array the batched actor reads
+    def read_epsilons(self):
+        if self.act_mode == "batched":
+            self.epsilons[:] = [agent.epsilon for agent in self.agent_list]
+
+    # Choose every agent's action at the start of the step, from the states the agents are in before any of them
+    # moves, in one forward pass of the shared network, with one random vector for every agent's epsilon decision
+    def act_all(self):
+        states = [World.encode_state(self, agent) for agent in self.agent_list]
+        q = self.agent_list[0].q_values_batch(states)
+        u = np.random.random(self.num_agents)
+        explore = u < self.epsilons
+        # An exploring agent's u / epsilon is uniform on [0, 1), so the same draw also picks its random action
+        random_actions = np.minimum(u / np.maximum(self.epsilons, 1e-12) * len(self.actions), len(self.actions) - 1)
+        chosen = np.where(explore, random_actions.astype(np.int64), q.argmax(axis=1))
+        for (agent, state, a) in zip(self.agent_list, states, chosen.tolist()):
+            agent.state = state
+            agent.action = self.actions[a]
+
+    # Precompute the tables that encode_state adds up
+    def make_encoder(self):
+        strides = self.states.strides
+        xy = self.transitions.cell_xy_list
+
+        # The order in which agents' coordinates are listed in each agent's state
+        self.layouts = []
+        for i in range(self.num_agents):
+            others = [j for j in range(self.num_agents) if j != i]
+            self.layouts.append([i] + others if self.shared == "yes" else list(range(self.num_agents)))
+
+        # What a cell contributes to the index when it fills each slot of the state
+        self.cell_codes = [[x * strides[2*k] + y * strides[2*k+1] for (x, y) in xy] for k in range(self.num_agents)]
+        goal_slot = 2 * self.num_agents
+        self.goal_codes = {g_id: gx * strides[goal_slot] + gy * strides[goal_slot+1] for ((gx, gy), g_id) in self.goals}
+
+        # With relative coordinates, the agent's own position is subtracted from every slot
+        if self.coords_type == "relative":
+            (sx, sy) = (sum(strides[::2]), sum(strides[1::2]))
+            self.own_codes = [-(x * sx + y * sy) - self.states.offset for (x, y) in xy]
+        else:
+            self.own_codes = [-self.states.offset for (x, y) in xy]
+
+    # Encode an agent's local state straight from the agents' cells as its integer index in the state space
+    # (equal to self.states.index(World.reformat_state(self, agent, self.coords_type)))
+    def encode_state(self, agent):
+        index = self.own_codes[agent.cell] + self.goal_codes[agent.goal]
+        cells = self.cells
+        for (k, j) in enumerate(self.layouts[agent.agent_id]):
+            index += self.cell_codes[k][cells[j]]
+        return index
+
+    # Reformat the global state for an individual agent as a tuple (for debugging, as agents learn from the index
+    # found by encode_state; self.states.state(index) gives the same tuple back)
     def reformat_state(self, agent, coords_type):
 
         reformatted_state = list(self.global_state)
         (px, py) = agent.position
 
+        # With a shared Q-table, list the agent's own coordinates first so that every agent sees the same layout
+        if self.shared == "yes":
+            i = 2 * agent.agent_id
+            reformatted_state = [px, py] + reformatted_state[:i] + reformatted_state[i + 2:]
+
         # Encode relative goal of the agent
         for ((gx, gy), g_id) in self.goals:
             if agent.goal == g_id:
                 reformatted_state.append(gx)
                 reformatted_state.append(gy)
 
-        if coords_type is "relative":
+        if coords_type == "relative":
 
             # Subtract an agent's own position from the global state
             reformatted_state[::2] = np.array(reformatted_state[::2]) - px
             reformatted_state[1::2] = np.array(reformatted_state[1::2]) - py
 
-        elif coords_type is "absolute":
+        elif coords_type == "absolute":
             pass
 
         return tuple(reformatted_state)
@@ -384,12 +550,66 @@ class World:
         else:
             agent.intent = "None"
 
-    # Save agents' Q-tables or Neural Networks to file
+    # Save agents' Q-tables or Neural Networks to file, along with the training state
     def write_to_file(self):
         for agent in self.agent_list:
             agent.save()
+            if self.shared == "yes":
+                break  # Every agent holds the same table, so only the first agent's file is written
+        World.save_training_state(self)
+
+    # Everything besides the Q-tables that training needs to carry on exactly where it left off
+    def training_state(self):
+        agents = [{key: getattr(agent, key) for key in RESUMED if hasattr(agent, key)} for agent in self.agent_list]
+        for (agent, saved) in zip(self.agent_list, agents):
+            if getattr(agent, "replay", None) is not None:
+                saved["replay"] = agent.replay.state()  # The transitions the agent's next minibatches are drawn from
+        return {"num_agents": self.num_agents, "time_step": self.time_step, "episode_count": self.episode_count,
+                "goal_count": self.goal_count, "collisions": self.collisions,
+                "cumulative_rewards": list(self.cumulative_rewards), "agent_collisions": list(self.agent_collisions),
+                "agent_goals": list(self.agent_goals), "agents": agents,
+                "random_state": random.getstate(),
+                "numpy_random_state": np.random.get_state()}
+
+    # Save the training state (or a snapshot of it) to file, through a temporary file
+    def save_training_state(self, directory='Saved_Files', state=None):
+        path = directory + '/world_saved.pkl'
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(World.training_state(self) if state is None else state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    # Restore the training state saved by save_training_state
+    def load_training_state(self, directory='Saved_Files'):
+        with open(directory + '/world_saved.pkl', 'rb') as f:
+            state = pickle.load(f)
+        if state["num_agents"] != self.num_agents:
+            raise ValueError("The training state was saved with %d agents, but the environment has %d"
+                             % (state["num_agents"], self.num_agents))
+
+        self.time_step = state["time_step"]
+        self.episode_count = state["episode_count"]
+        self.goal_count = state["goal_count"]
+        self.collisions = state["collisions"]
+        self.cumulative_rewards = list(state["cumulative_rewards"])
+        self.agent_collisions = list(state.get("agent_collisions", self.agent_collisions))
+        self.agent_goals = list(state.get("agent_goals", self.agent_goals))
+        for (agent, saved) in zip(self.agent_list, state["agents"]):
+            for (key, value) in saved.items():
+                if key == "cell":
+                    World.place(self, agent, value)  # To move the agent and keep the occupancy grid up to date
+                elif key == "replay":
+                    agent.replay.restore(value)
+                else:
+                    setattr(agent, key, value)
+
+        World.read_epsilons(self)
+
+        # The random number generators are restored last, so the next step draws what it would have drawn
+        random.setstate(state["random_state"])
+        np.random.set_state(state["numpy_random_state"])
 
     # In testing mode only
     def epsilon_greedy(self):
         for Agent in self.agent_list:
             Agent.epsilon = 0
+        World.read_epsilons(self)
@@ -0,0 +1,191 @@
+__author__ = 'Dylan Klein'
+'''This file records per-episode training metrics in ring buffers and streams them to a CSV or JSONL file'''
+
+import numpy as np
+import threading
+import queue
+import json
+import os
+
+
+class Metrics_Recorder:
+    """
+        Records one row per episode of a World (an episode ends whenever an agent collides or reaches a goal, as
+        counted by the World's episode_count): the episode count and time step it ended on, its length in steps, and
+        every agent's reward, collisions and goals during it.
+            - A step that ends several episodes records a row for each, in agent order: each row counts the collision
+              or goal that ended its episode, the first also holds the step's rewards and the steps since the last
+              episode ended, and the others have a length of 0 (their episodes began and ended on that step)
+            - Rows go into preallocated NumPy ring buffers holding the last 'capacity' episodes, which window()
+              summarises (e.g. the mean reward per agent over the last 100 episodes)
+            - Nothing is done on a step that does not end an episode: rewards are read from the World's running
+              totals when an episode ends
+            - If 'path' is given, rows are written to it ("csv" or "jsonl") in batches of 'flush_every' rows by a
+              background thread. The file is started afresh, unless 'append' is True (to carry on the file of a run
+              that is being resumed), in which case a CSV file must have the same columns as this run's rows
+
+            metrics = Metrics_Recorder(env, path='Saved_Files/metrics.csv')
+            while training:
+                observation, rewards, done, info = env.step()
+                metrics.update(done)
+            metrics.close()
+    """
+
+    def __init__(self, env, capacity=4096, path=None, fmt="csv", flush_every=256, append=False):
+
+        self.env = env
+        self.capacity = capacity
+        self.num_agents = env.num_agents
+        self.flush_every = min(flush_every, capacity)  # A batch must be written before the ring buffer wraps onto it
+
+        # Ring buffers of the last 'capacity' episodes
+        self.episode = np.zeros(capacity, dtype=np.int64)
+        self.time_step = np.zeros(capacity, dtype=np.int64)
+        self.length = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros((capacity, self.num_agents))
+        self.collisions = np.zeros((capacity, self.num_agents), dtype=np.int64)
+        self.goals = np.zeros((capacity, self.num_agents), dtype=np.int64)
+        self.count = 0  # Rows recorded so far
+        self.flushed = 0  # Rows handed to the writer so far
+
+        # The World's running totals when the last episode ended
+        self.last_episode = env.episode_count
+        self.last_step = env.time_step
+        self.last_rewards = np.array(env.cumulative_rewards, dtype=float)
+        self.last_collisions = np.array(env.agent_collisions)
+        self.last_goals = np.array(env.agent_goals)
+
+        # The writer thread appends batches of rows to the file
+        self.path = path
+        self.fmt = fmt
+        self.error = None  # An exception raised by the writer thread, re-raised on the training thread
+        if self.path is not None:
+            self.header = Metrics_Recorder.start_file(self, append)  # True if the file still needs its CSV header
+            self.batches = queue.Queue()
+            self.writer = threading.Thread(target=Metrics_Recorder.write_loop, args=(self,), daemon=True)
+            self.writer.start()
+
+    # The CSV header line of this run's rows
+    def columns(self):
+        agents = range(self.num_agents)
+        return ",".join(["episode", "time_step", "length"] + ["reward_%d" % a for a in agents] +
+                        ["collisions_%d" % a for a in agents] + ["goals_%d" % a for a in agents])
+
+    # Empty the file, or check that this run's rows can be appended to it, returning whether it needs a header
+    def start_file(self, append):
+        if not append or not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            open(self.path, 'w').close()
+            return True
+        if self.fmt == "csv":
+            with open(self.path) as f:
+                found = f.readline().rstrip("\n")
+            if found != Metrics_Recorder.columns(self):
+                raise ValueError("%s has the columns %s, which do not match this run's (%s), so rows cannot be "
+                                 "appended to it" % (self.path, found, Metrics_Recorder.columns(self)))
+        return False
+
+    # Record a row if the step ended an episode
+    def update(self, done):
+        if done is True:
+            Metrics_Recorder.record(self)
+
+    # Record the episodes that have just ended
+    def record(self):
+        env = self.env
+
+        # Each total minus its value when the last episode ended (written in place, so no arrays are created)
+        i = self.count % self.capacity
+        self.length[i] = env.time_step - self.last_step
+        self.last_step = env.time_step
+        for (row, last, totals) in ((self.rewards[i], self.last_rewards, env.cumulative_rewards),
+                                    (self.collisions[i], self.last_collisions, env.agent_collisions),
+                                    (self.goals[i], self.last_goals, env.agent_goals)):
+            row[:] = totals
+            row -= last
+            last[:] = totals
+
+        # Split the step's collisions and goals into one episode each
+        (collisions, goals) = (self.collisions[i].tolist(), self.goals[i].tolist())
+        self.collisions[i] = 0
+        self.goals[i] = 0
+        first = True
+        for a in range(self.num_agents):
+            for (counts, column) in ((collisions, self.collisions), (goals, self.goals)):
+                for _ in range(counts[a]):
+                    i = self.count % self.capacity
+                    if not first:
+                        self.length[i] = 0
+                        self.rewards[i] = 0
+                        self.collisions[i] = 0
+                        self.goals[i] = 0
+                    first = False
+                    column[i, a] = 1
+                    self.last_episode += 1
+                    self.episode[i] = self.last_episode
+                    self.time_step[i] = env.time_step
+                    self.count += 1
+
+                    if self.path is not None and self.count - self.flushed >= self.flush_every:
+                        Metrics_Recorder.flush(self)
+
+    # The positions in the ring buffers of recorded rows 'first' to 'last' (oldest first)
+    def rows(self, first, last):
+        return np.arange(first, last) % self.capacity
+
+    # Hand the rows recorded since the last flush to the writer thread (as copies, so the buffers can wrap)
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.count > self.flushed:
+            r = Metrics_Recorder.rows(self, self.flushed, self.count)
+            self.batches.put((self.episode[r], self.time_step[r], self.length[r], self.rewards[r],
+                              self.collisions[r], self.goals[r]))
+            self.flushed = self.count
+
+    # Summarise the last 'n' episodes (at most 'capacity')
+    def window(self, n=100):
+        n = min(n, self.count, self.capacity)
+        if n == 0:
+            return None
+        r = Metrics_Recorder.rows(self, self.count - n, self.count)
+        return {"episodes": n, "episode": int(self.episode[r[-1]]), "mean_length": float(self.length[r].mean()),
+                "mean_reward": self.rewards[r].mean(axis=0).tolist(),
+                "collisions": self.collisions[r].sum(axis=0).tolist(), "goals": self.goals[r].sum(axis=0).tolist()}
+
+    # Write batches as they arrive (on the writer thread)
+    def write_loop(self):
+        header = self.header
+        with open(self.path, 'a') as f:
+            while True:
+                batch = self.batches.get()
+                if batch is None:
+                    break
+                try:
+                    Metrics_Recorder.write(self, f, batch, header)
+                    header = False
+                    f.flush()
+                except Exception as e:
+                    self.error = e
+
+    # Format a batch of rows into the file
+    def write(self, f, batch, header):
+        (episode, time_step, length, rewards, collisions, goals) = [column.tolist() for column in batch]
+        if self.fmt == "jsonl":
+            for j in range(len(episode)):
+                f.write(json.dumps({"episode": episode[j], "time_step": time_step[j], "length": length[j],
+                                    "rewards": rewards[j], "collisions": collisions[j], "goals": goals[j]}) + "\n")
+        else:
+            if header:
+                f.write(Metrics_Recorder.columns(self) + "\n")
+            for j in range(len(episode)):
+                row = [episode[j], time_step[j], length[j]] + rewards[j] + collisions[j] + goals[j]
+                f.write(",".join(map(str, row)) + "\n")
+
+    # Write every remaining row and stop the writer thread
+    def close(self):
+        if self.path is not None:
+            Metrics_Recorder.flush(self)
+            self.batches.put(None)
+            self.writer.join()
+            if self.error is not None:
+                raise self.error
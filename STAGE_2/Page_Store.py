@@ -0,0 +1,243 @@
+__author__ = 'Dylan Klein'
+'''This file defines a disk-backed Q-table whose rows are paged in and out of a fixed memory budget'''
+
+from Checkpoint import encode_header, read_header, encode_pages, decode_pages, MATCHED
+from collections import OrderedDict
+import numpy as np
+import tempfile
+import weakref
+import os
+
+
+class Page_Store:
+    """
+        A (num_rows, num_cols) float32 table kept in a file, of which only the most recently used pages (blocks of
+        'page_rows' consecutive rows) are held in memory, up to 'memory_budget' bytes.
+            - The file is a checkpoint (see Checkpoint.py), so a flushed store can be loaded by any "Q_Array" agent
+            - A page that has never been written is not read from disk, but filled with 'initial' on first use
+            - Changed ("dirty") pages are written back when they are evicted, or by flush()
+            - A checkpoint only holds the pages that have been written (see Checkpoint.py), so it is as sparse as
+              the working file. begin_copy() flushes the dirty pages, after which copy_pages() can copy the file on
+              another thread (or process) while training carries on: until end_copy(), pages evicted in the meantime
+              are held in memory instead of being written to the file
+            - Rows are read and written like a NumPy array: store[s] is a row, store.item(s, a) a value, and
+              store[s, a] = value an update, so "Q_Array" agents can use a store in place of their array
+        The working file is created in 'directory' and deleted when the store is closed or garbage collected.
+    """
+
+    def __init__(self, num_rows, num_cols, header, memory_budget=64 * 2**20, page_rows=1024, initial=0.1,
+                 directory='Saved_Files/Pages', prefix='table_'):
+
+        self.shape = (num_rows, num_cols)
+        self.page_rows = page_rows
+        self.page_bytes = page_rows * num_cols * 4
+        self.num_pages = -(-num_rows // page_rows)
+        self.max_pages = max(2, memory_budget // self.page_bytes)  # The pages that fit in the memory budget
+        self.initial = initial
+
+        # Create the working file: the checkpoint header followed by a sparse (unallocated until written) table
+        os.makedirs(directory, exist_ok=True)
+        (fd, self.path) = tempfile.mkstemp(dir=directory, prefix=prefix, suffix='.pages')
+        (data, self.header) = encode_header(header, self.shape)
+        self.offset = self.header["offset"]
+        os.write(fd, data)
+        os.ftruncate(fd, self.offset + num_rows * num_cols * 4)
+        self.fd = fd
+        self.finalizer = weakref.finalize(self, Page_Store.remove, fd, self.path)
+
+        # Pages held in memory, from least to most recently used
+        self.pages = OrderedDict()
+        self.dirty = set()  # Pages that differ from the file
+        self.written = np.zeros(self.num_pages, dtype=bool)  # Pages that hold data in the file
+        self.copying = False  # True while the file is being copied into a checkpoint
+        self.held = {}  # Pages evicted while the file was being copied, to write back once it has been
+        (self.last_id, self.last_page) = (-1, None)  # The most recent page, to skip the cache on repeated use
+
+        # Counters for sizing the memory budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    # Close and delete a working file
+    @staticmethod
+    def remove(fd, path):
+        os.close(fd)
+        os.remove(path)
+
+    def __len__(self):
+        return self.shape[0]
+
+    # Find a page, reading it in (and evicting the least recently used page if over budget) on a miss
+    def page(self, p):
+        if p == self.last_id:
+            self.hits += 1
+            return self.last_page
+        page = self.pages.get(p)
+        if page is not None:
+            self.hits += 1
+            self.pages.move_to_end(p)
+        else:
+            self.misses += 1
+            page = Page_Store.read_page(self, p)
+            self.pages[p] = page
+            if len(self.pages) > self.max_pages:
+                Page_Store.evict(self)
+        (self.last_id, self.last_page) = (p, page)
+        return page
+
+    # Read a page from the file (or fill it with the initial value if it has never been written)
+    def read_page(self, p):
+        if p in self.held:
+            self.dirty.add(p)
+            return self.held.pop(p)
+        rows = min(self.page_rows, self.shape[0] - p * self.page_rows)
+        if not self.written[p]:
+            return np.full((rows, self.shape[1]), self.initial, dtype=np.float32)
+        data = os.pread(self.fd, rows * self.shape[1] * 4, self.offset + p * self.page_bytes)
+        return np.frombuffer(bytearray(data), dtype="<f4").reshape(rows, self.shape[1])
+
+    # Write a page back to the file (or hold it in memory while the file is being copied)
+    def write_page(self, p, page):
+        if self.copying:
+            self.held[p] = page
+            return
+        while self.held:
+            (q, held) = self.held.popitem()
+            os.pwrite(self.fd, held.tobytes(), self.offset + q * self.page_bytes)
+            self.written[q] = True
+        os.pwrite(self.fd, page.tobytes(), self.offset + p * self.page_bytes)
+        self.written[p] = True
+        self.writebacks += 1
+
+    # Drop the least recently used page from memory, writing it back first if it has changed
+    def evict(self):
+        (p, page) = self.pages.popitem(last=False)
+        if p in self.dirty:
+            self.dirty.discard(p)
+            Page_Store.write_page(self, p, page)
+        if p == self.last_id:
+            (self.last_id, self.last_page) = (-1, None)
+        self.evictions += 1
+
+    # A row of the table (store[s]), or a single value (store[s, a])
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return Page_Store.item(self, *key)
+        page = Page_Store.page(self, key // self.page_rows)
+        return page[key % self.page_rows]
+
+    def item(self, s, a):
+        return Page_Store.page(self, s // self.page_rows).item(s % self.page_rows, a)
+
+    # Update a single value (store[s, a] = value)
+    def __setitem__(self, key, value):
+        (s, a) = key
+        p = s // self.page_rows
+        Page_Store.page(self, p)[s % self.page_rows, a] = value
+        self.dirty.add(p)
+
+    # Write every dirty page back to the file
+    def flush(self):
+        for p in sorted(self.dirty):
+            Page_Store.write_page(self, p, self.pages[p])
+        self.dirty.clear()
+
+    # Start a snapshot on the training thread: flush the dirty pages and freeze the file until end_copy(), returning
+    # the pages it holds (to pass to copy_pages)
+    def begin_copy(self):
+        Page_Store.flush(self)
+        self.copying = True
+        return self.written.copy()
+
+    # Let training write to the file again
+    def end_copy(self):
+        self.copying = False
+
+    # Copy the written pages of the file into a sparse checkpoint file, followed by the pages in 'overlay' (pages not
+    # in the file yet), through a temporary file so that a crash never leaves half a file
+    def copy_pages(self, path, written, overlay=None):
+        overlay = overlay or {}
+        pages = written.copy()
+        pages[list(overlay)] = True
+        (data, header) = encode_header(dict(self.header, pages=encode_pages(pages, self.page_rows, self.initial)),
+                                       self.shape)
+        temp = path + '.tmp'
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, data)
+            os.ftruncate(fd, header["offset"] + self.shape[0] * self.shape[1] * 4)
+
+            # Copy each run of consecutive written pages (not in the overlay) in chunks of up to 16 MB
+            copied = written.copy()
+            copied[list(overlay)] = False
+            chunk = max(1, 2**24 // self.page_bytes)
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], copied.view(np.int8), [0]))))
+            for (start, stop) in zip(edges[::2], edges[1::2]):
+                for first in range(start, stop, chunk):
+                    size = min(stop, first + chunk) * self.page_bytes - first * self.page_bytes
+                    size = min(size, (self.shape[0] - first * self.page_rows) * self.shape[1] * 4)
+                    block = os.pread(self.fd, size, self.offset + first * self.page_bytes)
+                    os.pwrite(fd, block, header["offset"] + first * self.page_bytes)
+            for (p, page) in overlay.items():
+                os.pwrite(fd, page.tobytes(), header["offset"] + p * self.page_bytes)
+        finally:
+            os.close(fd)
+        os.replace(temp, path)
+
+    # Save the table into a checkpoint file from the training thread (without writing to the working file: the
+    # dirty and held pages are written straight into the checkpoint)
+    def save(self, path):
+        overlay = dict(self.held)
+        overlay.update((p, self.pages[p]) for p in self.dirty)
+        Page_Store.copy_pages(self, path, self.written, overlay)
+
+    # Replace the table with one saved in a checkpoint file, refusing one trained on a different environment
+    def load(self, path):
+        header = read_header(path)
+        for field in MATCHED + ["shape"]:
+            if header[field] != self.header[field]:
+                raise ValueError("%s was saved with %s=%r, but the environment has %s=%r"
+                                 % (path, field, header[field], field, self.header[field]))
+
+        # The saved pages that hold data (every page of a checkpoint saved from an array), which may be a different
+        # size from this store's pages
+        if "pages" in header:
+            (saved, saved_rows, self.initial) = (decode_pages(header), header["pages"]["page_rows"],
+                                                 header["pages"]["initial"])
+        else:
+            (saved, saved_rows) = (np.ones(1, dtype=bool), self.shape[0])
+        first = np.arange(self.num_pages) * self.page_rows // saved_rows  # The saved pages of each page's first row
+        last = (np.minimum(np.arange(1, self.num_pages + 1) * self.page_rows, self.shape[0]) - 1) // saved_rows
+        counts = np.concatenate(([0], np.cumsum(saved)))  # To count the saved pages with data in a range
+        written = counts[last + 1] > counts[first]
+
+        # Copy the pages that hold data, filling in the rows of any saved page that held none
+        with open(path, 'rb') as source:
+            for p in np.flatnonzero(written):
+                (start, stop) = (p * self.page_rows, min((p + 1) * self.page_rows, self.shape[0]))
+                source.seek(header["offset"] + start * self.shape[1] * 4)
+                page = np.frombuffer(bytearray(source.read((stop - start) * self.shape[1] * 4)), dtype="<f4")
+                page = page.reshape(stop - start, self.shape[1])
+                for q in range(start // saved_rows, (stop - 1) // saved_rows + 1):
+                    if not saved[q]:
+                        page[max(q * saved_rows, start) - start:min((q + 1) * saved_rows, stop) - start] = self.initial
+                os.pwrite(self.fd, page.tobytes(), self.offset + p * self.page_bytes)
+        self.pages.clear()
+        self.dirty.clear()
+        self.held.clear()
+        (self.last_id, self.last_page) = (-1, None)
+        self.written = written
+
+    # Delete the working file
+    def close(self):
+        self.pages.clear()
+        self.finalizer()
+
+    # The cache counters, and how much of the table is held in memory
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "writebacks": self.writebacks, "resident_pages": len(self.pages),
+                "max_pages": self.max_pages, "num_pages": self.num_pages,
+                "resident_bytes": len(self.pages) * self.page_bytes}
@@ -0,0 +1,165 @@
+__author__ = 'Dylan Klein'
+'''This file trains agents in several worker processes at once, periodically merging their Q-tables'''
+
+from Make_World import World
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import numpy as np
+import random
+import time
+
+
+'''
+    *** PARALLEL TRAINING ***
+    - Every worker process runs its own headless World with "Q_Array" agents
+    - Workers and the master share their Q-tables through shared memory, so no table is ever pickled
+    - Each round, every worker copies the master tables, trains for 'sync_steps' steps, and the master merges the
+      workers' tables back into the master copy:
+        merge="mean": the plain average of the workers' Q-values
+        merge="visits": each Q-value is weighted by how often the worker updated it in the round
+    - Only the first agent's table exists when shared="yes"
+'''
+
+
+# Create a NumPy array that lives in a shared memory block
+def shared_array(shape, dtype, name=None):
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    block = shared_memory.SharedMemory(name=name, create=name is None, size=size if name is None else 0)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+# Train a headless World in a worker process, one round per command from the master
+def worker(worker_id, config, names, commands, results):
+    random.seed(config["seed"] + worker_id)
+    env = World(map_type=config["map_type"], coords_type=config["coords_type"], num_agents=config["num_agents"],
+                agent_type="Q_Array", load="no", save="no", shared=config["shared"], render_mode="none")
+    shape = (config["num_tables"], env.num_states, len(env.actions))
+
+    # Attach to the master tables and to this worker's own tables and visit counts
+    (master_block, master) = shared_array(shape, np.float32, names[0])
+    (table_block, tables) = shared_array(shape, np.float32, names[1])
+    (visit_block, visits) = shared_array(shape, np.int32, names[2])
+    table_of = [agent.agent_id if config["shared"] != "yes" else 0 for agent in env.agent_list]
+    for agent in env.agent_list:
+        agent.Q = tables[table_of[agent.agent_id]]
+
+    while commands.get() is not None:
+        np.copyto(tables, master)
+        for agent in env.agent_list:
+            agent.greedy_state = -1  # The best actions the agents found are out of date with the master tables
+        visits[:] = 0
+        rewards = np.zeros(env.num_agents)
+        episodes = env.episode_count
+
+        for _ in range(config["sync_steps"]):
+            observation, step_rewards, done, info = env.step()
+            for agent in env.agent_list:
+                visits[table_of[agent.agent_id], agent.state, agent.action_index[agent.action]] += 1
+                rewards[agent.agent_id] += step_rewards[agent.agent_id]
+
+        results.put((worker_id, rewards, env.episode_count - episodes))
+
+    # Views of a block must be dropped before it can be closed
+    for agent in env.agent_list:
+        agent.Q = None
+    del master, tables, visits
+    for block in (master_block, table_block, visit_block):
+        block.close()
+
+
+# Merge the workers' tables into the master tables
+def merge_tables(master, tables, visits, merge):
+    if merge == "visits":
+        weights = visits.sum(axis=0)
+        merged = (tables * visits).sum(axis=0)
+        np.divide(merged, weights, out=master, where=weights > 0)  # Unvisited Q-values keep their master value
+    else:
+        np.mean(tables, axis=0, out=master)
+
+
+# *** TRAINING ***
+def start_parallel_training(map_type, coords_type, num_agents, shared, num_workers, sync_steps, rounds, merge, save, seed=0):
+
+    # A headless master world holds the master tables (and saves them like a normal World)
+    env = World(map_type=map_type, coords_type=coords_type, num_agents=num_agents, agent_type="Q_Array",
+                load="no", save=save, shared=shared, render_mode="none")
+    num_tables = 1 if shared == "yes" else num_agents
+    shape = (num_tables, env.num_states, len(env.actions))
+
+    master_block, master = shared_array(shape, np.float32)
+    table_blocks = [shared_array(shape, np.float32) for _ in range(num_workers)]
+    visit_blocks = [shared_array(shape, np.int32) for _ in range(num_workers)]
+    for agent in env.agent_list:
+        master[agent.agent_id if shared != "yes" else 0] = agent.Q
+        agent.Q = master[agent.agent_id if shared != "yes" else 0]
+
+    config = {"map_type": map_type, "coords_type": coords_type, "num_agents": num_agents, "shared": shared,
+              "num_tables": num_tables, "sync_steps": sync_steps, "seed": seed}
+    commands = [mp.Queue() for _ in range(num_workers)]
+    results = mp.Queue()
+    workers = []
+    for i in range(num_workers):
+        names = (master_block.name, table_blocks[i][0].name, visit_blocks[i][0].name)
+        process = mp.Process(target=worker, args=(i, config, names, commands[i], results), daemon=True)
+        process.start()
+        workers.append(process)
+
+    tables = visits = None
+    try:
+        start = time.time()
+        for r in range(1, rounds + 1):
+
+            # Every worker trains for one round starting from the master tables
+            for queue in commands:
+                queue.put("train")
+            rewards = np.zeros(num_agents)
+            episodes = 0
+            for _ in range(num_workers):
+                (worker_id, worker_rewards, worker_episodes) = results.get()
+                rewards += worker_rewards
+                episodes += worker_episodes
+
+            # Merge the workers' experience into the master tables
+            tables = np.stack([array for (block, array) in table_blocks])
+            visits = np.stack([array for (block, array) in visit_blocks])
+            merge_tables(master, tables, visits, merge)
+
+            # Print the agents' average reward per step and the overall throughput
+            steps = r * num_workers * sync_steps
+            print(r, steps, episodes, (rewards / (num_workers * sync_steps)).tolist(),
+                  "%.0f steps/s" % (steps / (time.time() - start)))
+
+    # A keyboard interrupt will stop training early
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for queue in commands:
+            queue.put(None)
+        for process in workers:
+            process.join(timeout=5)
+
+        # Save the merged tables through the master world's agents (which take a private copy first, as views of a
+        # block must be dropped before it can be closed)
+        for agent in env.agent_list:
+            agent.Q = np.array(agent.Q)
+        if save == "yes":
+            env.write_to_file()
+
+        blocks = [master_block] + [block for (block, array) in table_blocks + visit_blocks]
+        del master, table_blocks, visit_blocks, tables, visits
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+'''
+    *** MAIN PROGRAM ***
+    - 'num_workers' is the number of worker processes (one per core is a good start)
+    - 'sync_steps' is the number of steps each worker takes between merges
+    - 'rounds' is the number of merges before training stops
+'''
+
+if __name__ == '__main__':
+    start_parallel_training(map_type="plus", coords_type="absolute", num_agents=1, shared="no",
+                            num_workers=mp.cpu_count(), sync_steps=10000, rounds=100, merge="visits", save="yes")
@@ -0,0 +1,221 @@
+__author__ = 'Dylan Klein'
+'''This file plans Q-values from a World's known dynamics by value iteration, to start agents' Q-tables from'''
+
+from Map_Registry import read_map
+import numpy as np
+import argparse
+import hashlib
+import json
+import time
+import os
+
+PLANNER_VERSION = 3  # Bump when plans change, so that stale cached plans are never used
+
+
+'''
+    *** PLANNING ***
+    A World's dynamics are known from its compiled map: where every move leads, the rewards, how a collision respawns
+    an agent and how a new goal is drawn. Only the other agents' policies are unknown, so the planner has them take
+    random actions between the agent's moves (holding them still instead leaves an agent that stands on the goal there
+    for good, and the agent stuck waiting). A configuration is the agent's own cell, every other agent's cell and the
+    agent's goal; with 9 open cells and 4 goals, 2 agents have only 324 of them.
+        - The transition and reward tensors over every (configuration, action) pair are built with NumPy (a collision
+          or a goal leads to one of several configurations, one per goal that can be drawn next)
+        - Value iteration then sweeps the whole tensor at once until no value changes by more than 'tolerance'
+        - Each configuration is encoded as the World encodes its agents' states, giving the Q-values of those rows of
+          every agent's table (averaged over the configurations that share a state, as relative coordinates can)
+    A plan is cached in Saved_Files/Plans under a hash of everything it depends on, and World(warm_start="yes")
+    starts the agents' tables from it (rows no configuration reaches keep the usual 0.1).
+'''
+
+
+# Everything a plan depends on
+def plan_key(env):
+    h = env.hyperparameters
+    text = json.dumps([PLANNER_VERSION, read_map(env.map_type).digest, env.num_agents, env.coords_type, env.shared,
+                       env.actions, h["discount"], h["walk_punishment"], h["goal_reward"], h["crash_punishment"]])
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+# Build the transition and reward tensors of a World's configurations: 'rewards[c, a]', the configurations
+# 'next_configs[c, a, b]' that action a leads to from configuration c with probabilities 'probs[c, a, b]', and the
+# random moves of the other agents, 'moves[i, j]' (the probability of moving from open cell i to open cell j)
+def make_model(env):
+    t = env.transitions
+    open_cells = np.flatnonzero(~t.wall_mask)
+    (K, G, N) = (len(open_cells), len(env.goals), env.num_agents)
+    open_index = np.full(t.num_cells, -1, dtype=np.int64)  # The position of a cell among the open cells
+    open_index[open_cells] = np.arange(K)
+    goal_cells = np.array([t.cell(x, y) for ((x, y), g_id) in env.goals], dtype=np.int64)
+    start_cells = np.array([t.cell(x, y) for (x, y) in env.starts], dtype=np.int64)
+    h = env.hyperparameters
+    episodic = env.map_mode == "episodic"
+
+    # Where a random action moves an agent from each open cell (a blocked move leaves it where it is)
+    moves = np.zeros((K, K))
+    np.add.at(moves, (np.repeat(np.arange(K), len(env.actions)), open_index[t.next_cell[open_cells]].ravel()),
+              1 / len(env.actions))
+
+    # Every configuration, numbered as the mixed-radix number (own cell, other cells..., goal)
+    digits = np.indices((K,) * N + (G,)).reshape(N + 1, -1)
+    cells = open_cells[digits[:N]].T  # (configurations, agents), the agent's own cell first
+    goal = digits[N]
+    own = cells[:, 0]
+    others = cells[:, 1:]
+    C = len(goal)
+
+    rewards = np.zeros((C, len(env.actions)))
+    next_configs = np.zeros((C, len(env.actions), G), dtype=np.int64)
+    probs = np.zeros((C, len(env.actions), G))
+    for a in range(len(env.actions)):
+
+        # Move, collide with an agent or land on the goal, as World.step does
+        blocked = t.blocked[own, a]
+        new = t.next_cell[own, a]
+        collided = ~blocked & (others == new[:, None]).any(axis=1)
+        scored = ~blocked & ~collided & (new == goal_cells[goal])
+        rewards[:, a] = np.where(blocked | collided, -h["crash_punishment"],
+                                 np.where(scored, h["goal_reward"], -h["walk_punishment"]))
+
+        # A reset agent respawns in the first start cell no agent stands in (staying put if there is none)
+        respawned = collided | (scored & episodic)
+        vacant = ~(start_cells[None, :, None] == others[:, None, :]).any(axis=2)
+        vacant &= start_cells[None, :] != new[:, None]
+        spawn = np.where(vacant.any(axis=1), start_cells[vacant.argmax(axis=1)], new)
+        new = np.where(respawned, spawn, new)
+
+        # A new goal is drawn at random from the other goals, except one the agent stands on
+        drawn = collided | scored
+        allowed = (np.arange(G)[None, :] != goal[:, None]) & (goal_cells[None, :] != new[:, None])
+        stays = np.arange(G)[None, :] == goal[:, None]
+        p = np.where(drawn[:, None], allowed / np.maximum(allowed.sum(axis=1, keepdims=True), 1), stays)
+
+        # The configuration of each possible next goal (before the other agents move)
+        base = open_index[new]
+        for k in range(1, N):
+            base = base * K + digits[k]
+        next_configs[:, a, :] = base[:, None] * G + np.arange(G)[None, :]
+        probs[:, a, :] = p
+
+    return cells, goal, rewards, next_configs, probs, moves
+
+
+# Value iteration over every configuration at once, returning the Q-values of every (configuration, action) pair.
+# After the agent's move, every other agent takes a random action ('moves'), applied along each other agent's axis
+# of the values (as the agents move independently) rather than as a far larger transition tensor
+def value_iteration(rewards, next_configs, probs, moves, num_agents, discount, tolerance=1e-6, max_iterations=10000):
+    shape = (len(moves),) * num_agents + (-1,)
+    V = np.zeros(len(rewards))
+    for iteration in range(1, max_iterations + 1):
+        W = V.reshape(shape)
+        for k in range(1, num_agents):
+            W = np.moveaxis(np.tensordot(moves, W, axes=([1], [k])), 0, k)
+        Q = rewards + discount * (probs * W.reshape(-1)[next_configs]).sum(axis=2)
+        V2 = Q.max(axis=1)
+        residual = np.abs(V2 - V).max()
+        V = V2
+        if residual < tolerance:
+            break
+    return Q, iteration, residual
+
+
+# The state index every agent's table gives each configuration (as World.encode_state finds it)
+def encode_configs(env, cells, goal, agent_id):
+    codes = [np.array(c) for c in env.cell_codes]
+    goal_codes = np.array([env.goal_codes[g_id] for ((x, y), g_id) in env.goals])
+    own = cells[:, 0]
+
+    # The agents' cells in agent order, with this agent's own cell in its place
+    order = [agent_id] + [j for j in range(env.num_agents) if j != agent_id]
+    by_agent = np.empty_like(cells)
+    by_agent[:, order] = cells
+
+    index = np.array(env.own_codes)[own] + goal_codes[goal]
+    for (k, j) in enumerate(env.layouts[agent_id]):
+        index = index + codes[k][by_agent[:, j]]
+    return index
+
+
+# Plan every table of a World: a list (one per table) of the state indices planned and their Q-values
+def plan(env, tolerance=1e-6):
+    (cells, goal, rewards, next_configs, probs, moves) = make_model(env)
+    (Q, iterations, residual) = value_iteration(rewards, next_configs, probs, moves, env.num_agents,
+                                                env.hyperparameters["discount"], tolerance)
+    tables = []
+    for agent_id in range(1 if env.shared == "yes" else env.num_agents):
+        index = encode_configs(env, cells, goal, agent_id)
+        (states, inverse) = np.unique(index, return_inverse=True)
+        values = np.zeros((len(states), Q.shape[1]))
+        np.add.at(values, inverse, Q)
+        values /= np.bincount(inverse)[:, None]
+        tables.append((states, values.astype(np.float32)))
+    info = {"configurations": len(rewards), "iterations": iterations, "residual": float(residual),
+            "states": [len(states) for (states, values) in tables]}
+    return tables, info
+
+
+# The plan of a World and its info, read from the cache or planned (and cached) if it is not there
+# (info["cached"] tells which)
+def load_plan(env, directory='Saved_Files/Plans'):
+    path = os.path.join(directory, "%s-%s.npz" % (env.map_type, plan_key(env)))
+    if os.path.exists(path):
+        with np.load(path) as f:
+            tables = [(f["states_%d" % i], f["values_%d" % i]) for i in range(int(f["tables"]))]
+            info = json.loads(str(f["info"]))
+        return tables, dict(info, cached=True)
+    (tables, info) = plan(env)
+    os.makedirs(directory, exist_ok=True)
+    arrays = {"tables": len(tables), "info": json.dumps(info)}
+    for (i, (states, values)) in enumerate(tables):
+        (arrays["states_%d" % i], arrays["values_%d" % i]) = (states, values)
+    temp = path[:-len(".npz")] + ".%d.tmp.npz" % os.getpid()
+    np.savez(temp, **arrays)
+    os.replace(temp, path)
+    return tables, dict(info, cached=False)
+
+
+'''
+    *** MAIN PROGRAM ***
+    From the STAGE_2 directory, plan (and cache) every map for 1 and 2 agents and compare warm-started training with
+    training from scratch:
+        python Planner.py --num_agents 1 2 --evaluate 20000
+'''
+
+if __name__ == '__main__':
+    from Make_World import World
+    from Map_Registry import map_names
+    import random
+
+    parser = argparse.ArgumentParser(description="Plan and cache the initial Q-values of maps by value iteration")
+    parser.add_argument("--map_type", nargs="*", default=None, help="maps to plan (default: every map with goals)")
+    parser.add_argument("--num_agents", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--coords_type", default="absolute")
+    parser.add_argument("--shared", default="no")
+    parser.add_argument("--agent_type", default="Q_Sparse", help="the agents of the Worlds planned and evaluated")
+    parser.add_argument("--evaluate", type=int, default=0, help="train this many steps from the plan and from "
+                                                                "scratch, and compare their rewards")
+    args = parser.parse_args()
+
+    maps = args.map_type or [name for name in map_names() if read_map(name).goals]
+    for map_type in maps:
+        for num_agents in args.num_agents:
+            env = World(map_type=map_type, coords_type=args.coords_type, num_agents=num_agents,
+                        agent_type=args.agent_type, load="no", save="no", shared=args.shared, render_mode="none")
+            start = time.perf_counter()
+            (tables, info) = load_plan(env)
+            print("%s, %d agents: %d configurations, %d iterations (residual %.2g), %d planned rows per table, %.3f s%s"
+                  % (map_type, num_agents, info["configurations"], info["iterations"], info["residual"],
+                     info["states"][0], time.perf_counter() - start, " (cached)" if info["cached"] else ""))
+
+            # Mean reward per agent per step while training from the plan and from scratch
+            for warm_start in (["yes", "no"] if args.evaluate else []):
+                random.seed(0)
+                np.random.seed(0)
+                env = World(map_type=map_type, coords_type=args.coords_type, num_agents=num_agents,
+                            agent_type=args.agent_type, load="no", save="no", shared=args.shared, render_mode="none",
+                            warm_start=warm_start)
+                total = 0.0
+                for _ in range(args.evaluate):
+                    total += sum(env.step()[1])
+                print("    warm_start=%-3s mean reward per agent per step over %d steps: %.3f"
+                      % (warm_start, args.evaluate, total / (args.evaluate * num_agents)))
@@ -0,0 +1,72 @@
+__author__ = 'Dylan Klein'
+'''This file defines an optional profiler that times the phases of World.step and counts events per agent'''
+
+from time import perf_counter
+
+# The phases of an agent's turn in World.step, in the order they run
+PHASES = ["encode_state", "act", "move", "has_collided", "goal_check", "learn"]
+
+
+class Step_Profiler:
+    """
+        Accumulates the wall time and call count of every phase of World.step, and counts each agent's collisions,
+        goals and resets. A World only times its steps while 'env.profiler' is set:
+
+            env.profiler = Step_Profiler(env.num_agents, report_every=1000)   # print a report every 1000 episodes
+            ...
+            env.profiler.report()       # or env.profiler.summary() for a dict
+            env.profiler = None         # back to untimed steps
+    """
+
+    def __init__(self, num_agents, report_every=None):
+
+        self.times = [0.0] * len(PHASES)  # Seconds spent in each phase
+        self.calls = [0] * len(PHASES)  # Times each phase ran
+        self.steps = 0
+        self.step_time = 0.0  # Seconds spent in whole steps
+        self.collisions = [0] * num_agents  # Collisions caused by each agent
+        self.goals = [0] * num_agents  # Goals reached by each agent
+        self.resets = [0] * num_agents  # Times each agent was respawned
+        self.report_every = report_every  # Print a report every this many episodes (None to never print)
+        self.next_report = report_every
+
+    # Add the time since 't' to a phase, returning the current time (to start timing the next phase)
+    def lap(self, phase, t):
+        now = perf_counter()
+        self.times[phase] += now - t
+        self.calls[phase] += 1
+        return now
+
+    # Count a whole step, and print a report if one is due
+    def end_step(self, start, episode_count):
+        self.step_time += perf_counter() - start
+        self.steps += 1
+        if self.next_report is not None and episode_count >= self.next_report:
+            self.next_report = episode_count + self.report_every
+            print("*** PROFILE AT EPISODE %d ***" % episode_count)
+            Step_Profiler.report(self)
+
+    # Everything measured so far
+    def summary(self):
+        phases = {}
+        for (i, phase) in enumerate(PHASES):
+            phases[phase] = {"seconds": self.times[i], "calls": self.calls[i],
+                             "us_per_call": self.times[i] / self.calls[i] * 1e6 if self.calls[i] else 0.0,
+                             "fraction": self.times[i] / self.step_time if self.step_time else 0.0}
+        return {"steps": self.steps, "seconds": self.step_time,
+                "us_per_step": self.step_time / self.steps * 1e6 if self.steps else 0.0, "phases": phases,
+                "collisions": list(self.collisions), "goals": list(self.goals), "resets": list(self.resets)}
+
+    # Print the summary as a table
+    def report(self):
+        summary = Step_Profiler.summary(self)
+        print("%d steps, %.2f us per step" % (summary["steps"], summary["us_per_step"]))
+        for (phase, p) in summary["phases"].items():
+            print("    %-14s %10d calls %10.3f us/call %6.1f%%" % (phase, p["calls"], p["us_per_call"],
+                                                                  100 * p["fraction"]))
+        print("    %-14s %10.1f%%" % ("other", 100 * (1 - sum(p["fraction"] for p in summary["phases"].values()))))
+        print("    collisions", summary["collisions"], "goals", summary["goals"], "resets", summary["resets"])
+
+    # Start counting from zero again
+    def clear(self):
+        Step_Profiler.__init__(self, len(self.collisions), self.report_every)
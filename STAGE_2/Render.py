@@ -0,0 +1,154 @@
+__author__ = 'Dylan Klein'
+'''This file defines the renderers that a grid world can draw itself with'''
+
+import numpy as np
+
+
+# RGB values of the colours used on the board
+RGB = {"white": (255, 255, 255),
+       "black": (0, 0, 0),
+       "green": (0, 128, 0),
+       "orange": (255, 165, 0),
+       "blue": (0, 0, 255),
+       "pink": (255, 192, 203),
+       "purple": (128, 0, 128),
+       "yellow": (255, 255, 0)}
+
+
+# Find the pixel coordinates of the triangle pointing in the direction of an agent's intent
+def arrow_points(position, intent, L, triangle_size):
+    (x, y) = position
+    nudge = triangle_size / 2
+    if intent == "S":
+        return ((x + 0.5 - triangle_size) * L, (y + 0.5 - nudge) * L,
+                (x + 0.5 + triangle_size) * L, (y + 0.5 - nudge) * L,
+                (x + 0.5) * L, (y + 0.5 + triangle_size - nudge) * L)
+    elif intent == "W":
+        return ((x + 0.5 + nudge) * L, (y + 0.5 - triangle_size) * L,
+                (x + 0.5 + nudge) * L, (y + 0.5 + triangle_size) * L,
+                (x + 0.5 + nudge - triangle_size) * L, (y + 0.5) * L)
+    elif intent == "N":
+        return ((x + 0.5 - triangle_size) * L, (y + 0.5 + nudge) * L,
+                (x + 0.5 + triangle_size) * L, (y + 0.5 + nudge) * L,
+                (x + 0.5) * L, (y + 0.5 - triangle_size + nudge) * L)
+    elif intent == "E":
+        return ((x + 0.5 - nudge) * L, (y + 0.5 - triangle_size) * L,
+                (x + 0.5 - nudge) * L, (y + 0.5 + triangle_size) * L,
+                (x + 0.5 - nudge + triangle_size) * L, (y + 0.5) * L)
+    return None
+
+
+class Tk_Renderer:
+    """
+        Draws a world to a Tk window. Tk is only imported here, so a headless world never needs a display.
+    """
+
+    def __init__(self, world):
+
+        from tkinter import Tk, Canvas
+
+        self.world = world
+        L = world.L
+
+        # Create a board to render to
+        self.master = Tk()
+        self.board = Canvas(self.master, width=world.width * L, height=world.height * L)
+        self.board.grid(row=0, column=0)
+
+        # Render the static components of the environment
+        for i in range(world.width):
+            for j in range(world.height):
+                self.board.create_rectangle(i * L, j * L, (i + 1) * L, (j + 1) * L, fill="white", width=1)
+        for ((i, j), g_id) in world.goals:
+            self.board.create_rectangle(i * L, j * L, (i + 1) * L, (j + 1) * L, fill="green", width=1)
+        for (i, j) in world.walls:
+            self.board.create_rectangle(i * L, j * L, (i + 1) * L, (j + 1) * L, fill="black", width=1)
+
+        # Create objects for rendering agents
+        self.objects = {}
+        self.arrows = {}
+        for agent in world.agent_list:
+            (x, y) = agent.position
+            self.objects[agent.agent_id] = self.board.create_rectangle(x * L + L * 2 / 10,
+                                                                       y * L + L * 2 / 10,
+                                                                       x * L + L * 8 / 10,
+                                                                       y * L + L * 8 / 10,
+                                                                       fill=world.colours[agent.agent_id],
+                                                                       width=1, tag=world.names[agent.agent_id])
+
+            self.arrows[agent.agent_id] = self.board.create_polygon(0, 0, fill="black", width=1)
+
+    # Start rendering the 'master' object
+    def start(self):
+        self.master.mainloop()
+
+    def render(self, agents):
+        L = self.world.L
+        for agent in agents:
+            (x, y) = agent.position
+            self.board.coords(self.objects[agent.agent_id],
+                              x * L + L * 2 / 10,
+                              y * L + L * 2 / 10,
+                              x * L + L * 8 / 10,
+                              y * L + L * 8 / 10)
+            Tk_Renderer.update_arrow(self, agent)
+
+    def update_arrow(self, agent):
+        points = arrow_points(agent.position, agent.intent, self.world.L, self.world.triangle_size)
+        if points is not None:
+            self.board.coords(self.arrows[agent.agent_id], *points)
+
+
+class Image_Renderer:
+    """
+        Draws a world offscreen into a NumPy RGB frame of shape (height * L, width * L, 3), for occasional snapshots.
+        The static board is drawn once and copied for every frame.
+    """
+
+    def __init__(self, world):
+
+        self.world = world
+        L = world.L
+
+        # Render the static components of the environment, with a black grid line around every cell
+        self.background = np.zeros((world.height * L, world.width * L, 3), dtype=np.uint8)
+        for i in range(world.width):
+            for j in range(world.height):
+                Image_Renderer.fill_cell(self.background, i, j, L, "white")
+        for ((i, j), g_id) in world.goals:
+            Image_Renderer.fill_cell(self.background, i, j, L, "green")
+        for (i, j) in world.walls:
+            Image_Renderer.fill_cell(self.background, i, j, L, "black")
+        self.frame = self.background.copy()
+
+    # Paint the inside of a cell, leaving a one pixel border
+    @staticmethod
+    def fill_cell(image, i, j, L, colour):
+        image[j * L + 1:(j + 1) * L - 1, i * L + 1:(i + 1) * L - 1] = RGB[colour]
+
+    # Return a new frame showing every agent and the direction of its goal
+    def render(self, agents):
+        L = self.world.L
+        self.frame = self.background.copy()
+        for agent in agents:
+            (x, y) = agent.position
+            x0, y0 = int(x * L + L * 2 / 10), int(y * L + L * 2 / 10)
+            x1, y1 = int(x * L + L * 8 / 10), int(y * L + L * 8 / 10)
+            self.frame[y0:y1, x0:x1] = RGB[self.world.colours[agent.agent_id]]
+            Image_Renderer.update_arrow(self, agent)
+        return self.frame
+
+    # Fill the agent's arrow into the current frame (pixels whose centres lie inside the triangle)
+    def update_arrow(self, agent):
+        points = arrow_points(agent.position, agent.intent, self.world.L, self.world.triangle_size)
+        if points is None:
+            return
+        (ax, ay, bx, by, cx, cy) = points
+        left, right = int(min(ax, bx, cx)), int(np.ceil(max(ax, bx, cx)))
+        top, bottom = int(min(ay, by, cy)), int(np.ceil(max(ay, by, cy)))
+        px, py = np.meshgrid(np.arange(left, right) + 0.5, np.arange(top, bottom) + 0.5)
+        d1 = (px - bx) * (ay - by) - (ax - bx) * (py - by)
+        d2 = (px - cx) * (by - cy) - (bx - cx) * (py - cy)
+        d3 = (px - ax) * (cy - ay) - (cx - ax) * (py - ay)
+        inside = ~(((d1 < 0) | (d2 < 0) | (d3 < 0)) & ((d1 > 0) | (d2 > 0) | (d3 > 0)))
+        self.frame[top:bottom, left:right][inside] = RGB["black"]
@@ -0,0 +1,60 @@
+__author__ = 'Dylan Klein'
+'''This file defines a fixed-capacity experience replay memory held in preallocated NumPy arrays'''
+
+import numpy as np
+
+
+class Replay_Buffer:
+    """
+        A ring buffer of the last 'capacity' transitions (state index, action index, reward, next state index, done).
+        Adding a transition writes five array entries, and sample(k) draws k transitions uniformly at random (with
+        replacement) as five arrays, ready for a vectorised update. Sampling uses NumPy's global random state, and
+        the buffer is saved with the World's training state (see state() and restore()), so a World restored by
+        load_training_state samples the same minibatches.
+    """
+
+    def __init__(self, capacity):
+
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.size = 0  # Transitions held (at most 'capacity')
+        self.next = 0  # Where the next transition goes
+
+    def __len__(self):
+        return self.size
+
+    # Store a transition, overwriting the oldest once the buffer is full
+    def add(self, s, a, r, s2, done):
+        i = self.next
+        self.states[i] = s
+        self.actions[i] = a
+        self.rewards[i] = r
+        self.next_states[i] = s2
+        self.dones[i] = done
+        self.next = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    # Draw 'k' transitions uniformly at random
+    def sample(self, k):
+        i = np.random.randint(0, self.size, k)
+        return self.states.take(i), self.actions.take(i), self.rewards.take(i), self.next_states.take(i), self.dones.take(i)
+
+    # The transitions held and where the next one goes, as a dict of copies (to save with the training state)
+    def state(self):
+        return {"size": self.size, "next": self.next, "states": self.states[:self.size].copy(),
+                "actions": self.actions[:self.size].copy(), "rewards": self.rewards[:self.size].copy(),
+                "next_states": self.next_states[:self.size].copy(), "dones": self.dones[:self.size].copy()}
+
+    # Restore the transitions saved by state()
+    def restore(self, state):
+        if state["size"] > self.capacity:
+            raise ValueError("The saved replay buffer holds %d transitions, but the buffer only has room for %d"
+                             % (state["size"], self.capacity))
+        for name in ["states", "actions", "rewards", "next_states", "dones"]:
+            getattr(self, name)[:state["size"]] = state[name]
+        (self.size, self.next) = (state["size"], state["next"])
@@ -0,0 +1,231 @@
+__author__ = 'Dylan Klein'
+'''This file searches for good learning and reward settings by training many Worlds in parallel worker processes'''
+
+from Make_World import World, HYPERPARAMETERS
+import multiprocessing as mp
+import numpy as np
+import argparse
+import queue
+import hashlib
+import random
+import json
+import time
+import os
+
+
+'''
+    *** HYPERPARAMETER SWEEP ***
+    - A trial trains a headless World with one setting of the hyperparameters (see HYPERPARAMETERS in Make_World.py)
+      from one seed, for 'steps' steps, measuring the mean reward per agent per step over every 'eval_every' steps
+    - The search space gives each swept hyperparameter a list of values ("discount=0.3,0.6,0.9") or, for random
+      search, a range ("alpha_power=0.05:0.5", or "~0.01:0.5" to sample on a log scale). A grid search runs every
+      combination of the listed values; a random search ('trials' > 0) draws that many settings
+    - Trials run in a pool of 'workers' processes, one trial per process at a time, so every core is kept busy
+    - A trial is stopped early once it has trained for 'grace' of its steps, if its reward is below the median reward
+      of the finished trials at the same point (the median stopping rule, used once 'min_trials' trials have finished)
+    - Every finished trial is appended to a JSON lines file as it finishes, so a sweep that is stopped carries on
+      with the trials it has not run yet when it is run again with the same arguments
+    - The settings are then ranked by their score (the mean reward over the last 'tail' of training, averaged over
+      seeds) and written as a CSV table. Settings with a trial that was stopped early rank after the rest, scored
+      at the point where they were stopped
+'''
+
+
+# Parse the search space ("name=v1,v2,..." lists, "name=low:high" and "name=~low:high" ranges)
+def parse_space(specs):
+    space = {}
+    for spec in specs:
+        (name, values) = spec.split("=", 1)
+        if name not in HYPERPARAMETERS:
+            raise ValueError("Unknown hyperparameter %r (the hyperparameters are %s)"
+                             % (name, ", ".join(HYPERPARAMETERS)))
+        if ":" in values:
+            log = values.startswith("~")
+            (low, high) = [float(v) for v in values.lstrip("~").split(":")]
+            space[name] = {"low": low, "high": high, "log": log}
+        else:
+            space[name] = [float(v) for v in values.split(",")]
+    return space
+
+
+# Every setting of the sweep: all combinations of the listed values, or 'trials' random draws from the space
+# (drawn from 'seed', so that a resumed sweep draws the same settings)
+def make_settings(space, trials, seed):
+    if trials == 0:
+        settings = [{}]
+        for (name, values) in space.items():
+            if isinstance(values, dict):
+                raise ValueError("%s is a range, which needs a random search (trials > 0)" % name)
+            settings = [dict(setting, **{name: value}) for setting in settings for value in values]
+        return settings
+
+    rng = random.Random(seed)
+    settings = []
+    for _ in range(trials):
+        setting = {}
+        for (name, values) in space.items():
+            if isinstance(values, list):
+                setting[name] = rng.choice(values)
+            elif values["log"]:
+                setting[name] = float(np.exp(rng.uniform(np.log(values["low"]), np.log(values["high"]))))
+            else:
+                setting[name] = rng.uniform(values["low"], values["high"])
+        settings.append(setting)
+    return settings
+
+
+# The name a trial is saved under, from everything that changes its result
+def trial_key(config, setting, seed):
+    text = json.dumps([config, sorted(setting.items()), seed], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+# Train one trial (in a worker process), stopping early if it falls below 'reference' (the median reward curve of
+# the finished trials) once past the grace period
+def run_trial(job):
+    (key, config, setting, seed, reference) = job
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    env = World(map_type=config["map_type"], coords_type=config["coords_type"], num_agents=config["num_agents"],
+                agent_type=config["agent_type"], load="no", save="no", shared=config["shared"], render_mode="none",
+                hyperparameters=setting, alpha_schedule=config["alpha_schedule"])
+
+    curve = []
+    points = config["steps"] // config["eval_every"]
+    grace = int(np.ceil(config["grace"] * points))
+    stopped = False
+    for point in range(points):
+        total = 0.0
+        for _ in range(config["eval_every"]):
+            total += sum(env.step()[1])
+        curve.append(total / (config["eval_every"] * env.num_agents))
+        if point + 1 >= grace and point < len(reference) and curve[-1] < reference[point] and point + 1 < points:
+            stopped = True
+            break
+
+    tail = max(1, int(config["tail"] * points))
+    return {"key": key, "setting": setting, "seed": seed, "curve": curve, "stopped": stopped,
+            "steps": len(curve) * config["eval_every"], "seconds": time.perf_counter() - start,
+            "score": float(np.mean(curve[-tail:]))}
+
+
+# The median reward curve of the finished trials (as far as at least half of them reached)
+def median_curve(results):
+    curves = [r["curve"] for r in results]
+    reference = []
+    for point in range(max((len(c) for c in curves), default=0)):
+        values = [c[point] for c in curves if len(c) > point]
+        if 2 * len(values) < len(curves):
+            break
+        reference.append(float(np.median(values)))
+    return reference
+
+
+# Run every trial not found in 'path', appending each to it as it finishes, with 'workers' trials running at a time
+def run_sweep(config, settings, seeds, path, workers):
+    results = []
+    if os.path.exists(path):
+        with open(path) as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    done = {r["key"] for r in results}
+    jobs = [(trial_key(config, setting, seed), setting, seed) for setting in settings for seed in range(seeds)]
+    keys = {key for (key, setting, seed) in jobs}
+    print("%d trials, %d already run" % (len(jobs), len(keys & done)))
+    jobs = [job for job in jobs if job[0] not in done]
+
+    # New trials are handed out as others finish, each judged against the trials finished by then
+    finished = queue.Queue()  # Filled by the pool's result thread
+    running = 0
+    with mp.Pool(workers) as pool, open(path, 'a') as f:
+        while jobs or running:
+            while jobs and running < workers:
+                (key, setting, seed) = jobs.pop(0)
+                complete = [r for r in results if not r["stopped"]]
+                reference = median_curve(complete) if len(complete) >= config["min_trials"] else []
+                pool.apply_async(run_trial, ((key, config, setting, seed, reference),), callback=finished.put,
+                                 error_callback=finished.put)
+                running += 1
+            result = finished.get()  # The next trial to finish
+            running -= 1
+            if isinstance(result, Exception):
+                raise result
+            results.append(result)
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            print("%4d %-8s score %8.4f %s seed %d" % (len(results), "stopped" if result["stopped"] else "done",
+                                                     result["score"], result["setting"], result["seed"]))
+
+    return [r for r in results if r["key"] in keys]
+
+
+# Rank the settings by their mean score over seeds (those with a trial stopped early last), print the best and write
+# them all to a CSV table
+def rank(results, names, path, top=10):
+    groups = {}
+    for r in results:
+        groups.setdefault(json.dumps([r["setting"].get(name) for name in names]), []).append(r)
+    rows = []
+    for (values, runs) in groups.items():
+        scores = [r["score"] for r in runs]
+        rows.append(json.loads(values) + [float(np.mean(scores)), float(np.std(scores)), len(runs),
+                                           sum(r["stopped"] for r in runs), sum(r["steps"] for r in runs)])
+    rows.sort(key=lambda row: (row[len(names) + 3] > 0, -row[len(names)]))
+
+    columns = names + ["score", "score_std", "trials", "stopped", "steps"]
+    with open(path, 'w') as f:
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join(map(str, row)) + "\n")
+
+    print()
+    print(" ".join("%14s" % c for c in columns))
+    for row in rows[:top]:
+        print(" ".join("%14.6g" % v for v in row))
+    return rows
+
+
+'''
+    *** MAIN PROGRAM ***
+    From the STAGE_2 directory:
+        python Sweep.py discount=0.3,0.6,0.9 epsilon_decay=0.9,0.99             # A grid of 6 settings
+        python Sweep.py discount=0.1:0.95 alpha_power=~0.01:0.5 --trials 50 --seeds 2 --name random
+    Run the same command again to carry on a sweep that was stopped part of the way through.
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep World hyperparameters over a pool of worker processes")
+    parser.add_argument("space", nargs="+", help="name=v1,v2,... or name=low:high or name=~low:high, for any of %s"
+                        % ", ".join(HYPERPARAMETERS))
+    parser.add_argument("--trials", type=int, default=0, help="settings to draw at random (0 for a grid search)")
+    parser.add_argument("--seeds", type=int, default=1, help="trials per setting, seeded 0, 1, ...")
+    parser.add_argument("--map_type", default="plus")
+    parser.add_argument("--coords_type", default="absolute")
+    parser.add_argument("--num_agents", type=int, default=2)
+    parser.add_argument("--agent_type", default="Q_Array")
+    parser.add_argument("--shared", default="no")
+    parser.add_argument("--alpha_schedule", default="time", help='"time" or "visits" (to sweep visit_power)')
+    parser.add_argument("--steps", type=int, default=200000, help="steps per trial")
+    parser.add_argument("--eval_every", type=int, default=5000, help="steps per point of a trial's reward curve")
+    parser.add_argument("--grace", type=float, default=0.25, help="fraction of its steps a trial runs before it "
+                                                                  "can be stopped early (1 to never stop trials)")
+    parser.add_argument("--min_trials", type=int, default=5, help="finished trials needed before any is stopped early")
+    parser.add_argument("--tail", type=float, default=0.2, help="fraction of training a trial is scored over")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--name", default="sweep", help="the sweep's files are Saved_Files/Sweeps/<name>.jsonl/.csv")
+    parser.add_argument("--sample_seed", type=int, default=0, help="seed for drawing the random search's settings")
+    args = parser.parse_args()
+
+    space = parse_space(args.space)
+    settings = make_settings(space, args.trials, args.sample_seed)
+    config = {"map_type": args.map_type, "coords_type": args.coords_type, "num_agents": args.num_agents,
+              "agent_type": args.agent_type, "shared": args.shared, "alpha_schedule": args.alpha_schedule,
+              "steps": args.steps, "eval_every": args.eval_every, "grace": args.grace, "min_trials": args.min_trials,
+              "tail": args.tail}
+
+    os.makedirs('Saved_Files/Sweeps', exist_ok=True)
+    start = time.perf_counter()
+    results = run_sweep(config, settings, args.seeds, 'Saved_Files/Sweeps/%s.jsonl' % args.name, args.workers)
+    rank(results, list(space), 'Saved_Files/Sweeps/%s.csv' % args.name)
+    print("%d trials in %.1f s, ranked in Saved_Files/Sweeps/%s.csv" % (len(results), time.perf_counter() - start,
+                                                                      args.name))
@@ -0,0 +1,157 @@
+__author__ = 'Dylan Klein'
+'''This file defines a vectorised environment that steps many copies of a grid world in lockstep'''
+
+from Make_World import World, read_hyperparameters
+from State_Space import make_states
+from Map_Registry import read_map
+import numpy as np
+
+
+class VecWorld:
+    """
+        K independent copies of a World map, held in NumPy arrays of shape (K, num_agents, ...) and advanced together.
+        Rewards, collisions, goals and respawning follow World.step, with one difference:
+        every agent's action for a step is given up front (chosen from the state at the start of the step), while
+        the agents still move one at a time in a random order per world.
+
+            observation = env.reset()                       # (K, num_agents) integer state indices
+            observation, rewards, restart, info = env.step(actions)   # actions: (K, num_agents) action indices
+
+        The state indices match World.reformat_state followed by State_Space.encode for the same coords_type.
+        'hyperparameters' overrides the defaults as it does for World (only the reward settings apply here).
+    """
+
+    def __init__(self, num_worlds, map_type, coords_type, num_agents, shared="no", seed=None, hyperparameters=None):
+
+        # Environment variables (as in World, including the reward settings given in 'hyperparameters')
+        self.hyperparameters = read_hyperparameters(hyperparameters)
+        self.actions = ["up", "down", "left", "right", "none"]
+        self.walk_punishment = self.hyperparameters["walk_punishment"]
+        self.goal_reward = self.hyperparameters["goal_reward"]
+        self.crash_punishment = self.hyperparameters["crash_punishment"]
+        self.width, self.height, walls, goals, starts, self.map_mode = World.create_map(None, map_type)
+        self.coords_type = coords_type
+        self.shared = shared
+
+        # Compile the map into arrays (agents' positions are held as cell numbers)
+        self.transitions = read_map(map_type).transitions(self.actions)
+        self.goal_cells = self.transitions.goal_cells
+        self.goal_ids = [g_id for (cell, g_id) in goals]  # One-hot goal of each entry of goal_cells
+        self.starts = self.transitions.start_cells
+
+        # Multi-agent variables
+        self.num_worlds = num_worlds
+        self.num_agents = num_agents
+        self.states = make_states(self.num_agents, self.width, self.height)
+        self.rng = np.random.default_rng(seed)
+        self.rows = np.arange(self.num_worlds)
+
+        # Order in which each agent's coordinates are listed in its own state
+        self.layout = np.array([[i] + [j for j in range(num_agents) if j != i] if shared == "yes" else list(range(num_agents))
+                                for i in range(num_agents)])
+
+        # RL variables
+        self.cells = np.zeros((num_worlds, num_agents), dtype=np.int64)
+        self.occupancy = np.zeros((num_worlds, self.transitions.num_cells), dtype=np.int64)  # Agents per cell
+        self.goals = np.full((num_worlds, num_agents), -1, dtype=np.int64)  # Entry of goal_cells, -1 for no goal yet
+        self.rewards = np.zeros((num_worlds, num_agents))
+        self.collisions = np.zeros(num_worlds, dtype=np.int64)
+        self.episode_count = np.ones(num_worlds, dtype=np.int64)
+        self.time_step = 0
+
+    # Spawn every world's agent 'agents' (one per world in 'worlds') in its first vacant starting cell
+    def spawn(self, worlds, agents):
+        vacant = self.occupancy[worlds][:, self.starts] == 0
+        found = vacant.any(1)
+        first = vacant.argmax(1)
+        VecWorld.place(self, worlds[found], agents[found], self.starts[first[found]])
+
+    # Move agents to new cells, updating the occupancy grid ('worlds' must not repeat)
+    def place(self, worlds, agents, cells):
+        self.occupancy[worlds, self.cells[worlds, agents]] -= 1
+        self.occupancy[worlds, cells] += 1
+        self.cells[worlds, agents] = cells
+
+    # Pick a random new goal that is neither the current goal nor the cell the agent is standing on
+    def new_goal(self, worlds, agents):
+        current = self.goals[worlds, agents]
+        here = self.cells[worlds, agents]
+        allowed = (np.arange(len(self.goal_cells))[None, :] != current[:, None]) & \
+                  (self.goal_cells[None, :] != here[:, None])
+        scores = np.where(allowed, self.rng.random(allowed.shape), -1)
+        self.goals[worlds, agents] = scores.argmax(1)
+
+    # Respawn an agent with a new goal
+    def reset_agents(self, worlds, agents):
+        VecWorld.spawn(self, worlds, agents)
+        VecWorld.new_goal(self, worlds, agents)
+
+    # Reset every world, spawning the agents one at a time as World does
+    def reset(self):
+        self.cells[:] = 0
+        self.occupancy[:] = 0
+        self.occupancy[:, 0] = self.num_agents  # Agents start in cell 0 until they are spawned
+        self.goals[:] = -1
+        for i in range(self.num_agents):
+            VecWorld.reset_agents(self, self.rows, np.full(self.num_worlds, i))
+        return VecWorld.observe(self)
+
+    # Encode every agent's state in every world as an integer index of the state space
+    def observe(self):
+        xy = self.transitions.cell_xy
+        coords = xy[self.cells[:, self.layout]].reshape(self.num_worlds, self.num_agents, -1)
+        goal = xy[self.goal_cells[self.goals]]
+        state = np.concatenate([coords, goal], axis=2)
+        if self.coords_type == "relative":
+            state = state.reshape(self.num_worlds, self.num_agents, -1, 2) - xy[self.cells][:, :, None, :]
+            state = state.reshape(self.num_worlds, self.num_agents, -1)
+        return state @ np.array(self.states.strides) - self.states.offset
+
+    # Advance every world by one step, given the action index of every agent in every world
+    def step(self, actions):
+        self.time_step += 1
+        self.rewards[:] = 0
+        restart = np.zeros(self.num_worlds, dtype=bool)
+        order = np.argsort(self.rng.random((self.num_worlds, self.num_agents)), axis=1)  # Random turn order per world
+        rows = self.rows
+
+        for turn in range(self.num_agents):
+            agents = order[:, turn]
+
+            # Look up the moves in the compiled transition tables
+            cells = self.cells[rows, agents]
+            moves = actions[rows, agents]
+            new = self.transitions.next_cell[cells, moves]
+            valid = ~self.transitions.blocked[cells, moves]
+
+            # Move where possible, otherwise the cell must belong to a wall or lie outside the world boundaries
+            VecWorld.place(self, rows, agents, new)
+            self.rewards[rows, agents] = np.where(valid, -self.walk_punishment, -self.crash_punishment)
+
+            # Check for a collision of agents
+            crashed = valid & (self.occupancy[rows, new] > 1)
+            if crashed.any():
+                (worlds, movers) = (rows[crashed], agents[crashed])
+                self.rewards[worlds, movers] = -self.crash_punishment
+                if self.map_mode == "episodic":
+                    for i in range(self.num_agents):
+                        VecWorld.reset_agents(self, worlds, np.full(len(worlds), i))
+                else:
+                    VecWorld.reset_agents(self, worlds, movers)
+                self.collisions[worlds] += 1
+                self.episode_count[worlds] += 1
+                restart[worlds] = True
+
+            # Check for landing on the agent's goal
+            scored = valid & ~crashed & (new == self.goal_cells[self.goals[rows, agents]])
+            if scored.any():
+                (worlds, movers) = (rows[scored], agents[scored])
+                self.rewards[worlds, movers] = self.goal_reward
+                if self.map_mode == "episodic":
+                    VecWorld.reset_agents(self, worlds, movers)
+                else:
+                    VecWorld.new_goal(self, worlds, movers)
+                self.episode_count[worlds] += 1
+                restart[worlds] = True
+
+        return VecWorld.observe(self), self.rewards.copy(), restart, ""
@@ -3,26 +3,57 @@ __author__ = 'Dylan Klein'
 
 
 from Make_World import World
-import numpy as np
+from Checkpoint import Checkpointer
+from Metrics import Metrics_Recorder
 import threading
 import time
 
 
 '''
     *** CREATE AN ENVIRONMENT OBJECT ***
-    - 'map_type' defines the geometry of the world
+    - 'map_type' defines the geometry of the world (the name of a map in the Maps directory, see Map_Registry.py)
     - 'num_agents' defines the number of agents in the environment
-    - 'agent_type' defines the algorithm driving each agent
+    - 'agent_type' defines the algorithm driving each agent:
+        "Q_Table" stores Q-values in a dict of dicts, "Q_Array" stores them in a dense NumPy array,
+        "Q_Sparse" only creates the dict entries of visited states (optionally evicting cold ones, see 'max_rows')
+        "Q_Paged" keeps the array on disk, paging rows in and out of 'memory_budget' bytes (for 3 or 4 agents)
+        "DQN" learns a small NumPy neural network over the state variables from minibatches of replayed transitions
+    - shared="yes": all agents read and update one Q-table (the state is listed from each agent's point of view)
+    - replay_size, replay_batch: a "Q_Array" agent keeps its last 'replay_size' transitions and replays 'replay_batch'
+      of them per step as one batched update (more learning per environment step, at the cost of a slower step)
+    - act_mode="sequential": agents take turns, each choosing its action after seeing the moves of the agents before
+      it; act_mode="batched": every agent chooses its action from the state at the start of the step, before any
+      agent moves, in one forward pass of the network ("DQN" agents with shared="yes")
+    - hyperparameters: a dict overriding any of the default learning and reward settings (HYPERPARAMETERS in
+      Make_World.py: discount, epsilon, epsilon_decay, alpha_power, visit_power, walk_punishment, goal_reward,
+      crash_punishment); Sweep.py searches for good settings
+    - alpha_schedule="time": learning rates decay as time ** -alpha_power, "visits": a "Q_Array" agent counts the
+      updates n of every state-action pair and learns it at the rate 1 / (1 + n) ** visit_power (see visit_stats())
+    - warm_start="yes": starts the agents' Q-tables (any agent_type but "DQN") from Q-values planned by value
+      iteration over the map (see Planner.py), instead of learning them from scratch; ignored with load="yes"
     - load="no": creates a new neural network for agents, load="yes": loads neural networks from file
+      (along with the training state, so that training carries on exactly where it left off)
     - save="no": does not save agents' neural networks to file, save="yes": saves neural networks to file
+      ("Q_Array" tables are saved as .qck checkpoints; convert an old .pkl table with Checkpoint.py)
+    - While training with save="yes", the tables are also checkpointed every 'checkpoint_seconds' seconds into
+      Saved_Files/Checkpoints, keeping the newest 'checkpoint_keep' checkpoints
+    - render_mode="tk": draws to a window, "image": draws NumPy RGB frames offscreen, "none": runs headless
+    - To find where training time goes, set env.profiler = Step_Profiler(env.num_agents, report_every=1000) (from
+      Profiler.py) to print the time spent in each phase of a step, and each agent's collisions, goals and resets
 '''
 
-env = World(map_type="plus", coords_type="absolute", num_agents=1, agent_type="Q_Table", load="no", save="yes")
+env = World(map_type="plus", coords_type="absolute", num_agents=1, agent_type="Q_Table", load="no", save="yes",
+            render_mode="tk")
+checkpoint_seconds = 300
+checkpoint_keep = 3
+metrics_path = 'Saved_Files/metrics.csv'  # Every episode's rewards, length, collisions and goals (None to not write)
+# The file is written afresh by every run, and carried on by a run that resumes training with load="yes"
+report_every = 100  # Print the statistics of the last 'report_every' episodes this often
 
 
 # Save agents' Q-tables or Neural Networks to file
 def save_agents():
-    if env.save is "yes" and env.load is "no":
+    if env.save == "yes":
         env.write_to_file()
 
 
@@ -37,32 +68,43 @@ def start_testing():
 
 # *** TRAINING ***
 def start_training():
+    checkpointer = Checkpointer(env, every_seconds=checkpoint_seconds, keep=checkpoint_keep) if env.save == "yes" else None
+    metrics = Metrics_Recorder(env, path=metrics_path, append=env.load == "yes")
+    interrupted = False
     try:
-        # Initialise loop variables
-        cumulative_rewards = [0] * env.num_agents
-
         while True:
             ep = env.episode_count
 
             # Take a step in the environment
             observation, rewards, done, info = env.step()
+            metrics.update(done)
+            if checkpointer is not None:
+                checkpointer.update()
 
-            # Calculate the agents' cumulative rewards
-            cumulative_rewards = np.array(cumulative_rewards) + np.array(rewards)
-
-            # Print the agents' average reward per episode
-            if done is True and ep % 100 is 0:
-                print(ep, list(cumulative_rewards / ep))
+            # Print the agents' mean reward per episode over the last window (once per window, even if a step ends
+            # several episodes at once)
+            if done is True and env.episode_count // report_every > ep // report_every:
+                window = metrics.window(report_every)
+                print(env.episode_count, window["mean_reward"], "collisions", window["collisions"],
+                      "goals", window["goals"])
 
     # A keyboard interrupt will exit training mode
     except KeyboardInterrupt:
+        interrupted = True
         save_agents()
 
     finally:
-        tk = threading.Thread(target=start_testing)
-        tk.daemon = True
-        tk.start()
-        env.start_game()
+        # Write the last metrics, and wait for the last checkpoint to be written
+        metrics.close()
+        if checkpointer is not None:
+            checkpointer.close(final=False, interrupted=interrupted)
+
+        # Watch the trained agents, if there is a window to watch them in
+        if env.render_mode == "tk":
+            tk = threading.Thread(target=start_testing)
+            tk.daemon = True
+            tk.start()
+            env.start_game()
 
 
 '''